@@ -0,0 +1,15 @@
+# benchmarks/__init__.py
+# copyright 2024 Kuupa Ork <kuupaork+github@hfdl.observer>
+# see LICENSE (or https://github.com/hfdl-observer/hfdlobserver888/blob/main/LICENSE) for terms of use.
+# TL;DR: BSD 3-clause
+#
+# Benchmarks are run as modules from the repository root, eg. `python3 -m benchmarks.json_decoding <packetlog>`.
+# The observer's modules live in `src`, which is not normally on the path, so add it (as hfdlobserver888.sh does).
+
+import pathlib
+import sys
+
+
+SRC_PATH = pathlib.Path(__file__).parent.parent / 'src'
+if str(SRC_PATH) not in sys.path:
+    sys.path.insert(0, str(SRC_PATH))
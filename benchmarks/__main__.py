@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# benchmarks/__main__.py
+# copyright 2024 Kuupa Ork <kuupaork+github@hfdl.observer>
+# see LICENSE (or https://github.com/hfdl-observer/hfdlobserver888/blob/main/LICENSE) for terms of use.
+# TL;DR: BSD 3-clause
+#
+# Runs the hot path benchmark suite, and writes the results as JSON so runs from different versions can be compared.
+#
+#   $ python3 -m benchmarks [--repeat N] [--output results.json] [--compare baseline.json] [<case prefix> ...]
+
+import datetime
+import json
+import logging
+import pathlib
+import platform
+import subprocess
+
+from typing import Any, Optional
+
+import click
+
+import benchmarks.suite
+
+
+def revision() -> Optional[str]:
+    try:
+        result = subprocess.run(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=pathlib.Path(__file__).parent, capture_output=True, text=True, check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def comparison(result: dict[str, Any], baseline: Optional[dict[str, Any]]) -> str:
+    if not baseline:
+        return ''
+    # > 1 is faster than the baseline.
+    return f'  x{baseline["per_op_us"] / result["per_op_us"]:.2f}'
+
+
+@click.command
+@click.option('--repeat', help='timing runs per case (best is reported)', default=5)
+@click.option(
+    '--output', help='write the results to this JSON file', default=None,
+    type=click.Path(path_type=pathlib.Path, dir_okay=False, writable=True),
+)
+@click.option(
+    '--compare', help='compare against results previously written with --output', default=None,
+    type=click.Path(path_type=pathlib.Path, dir_okay=False, exists=True),
+)
+@click.argument('cases', nargs=-1)
+def command(repeat: int, output: Optional[pathlib.Path], compare: Optional[pathlib.Path], cases: list[str]) -> None:
+    names = benchmarks.suite.matching(list(cases))
+    if not names:
+        raise click.ClickException(f'no cases match {" ".join(cases)}')
+    # the code under test logs freely; that is not what is being measured.
+    logging.disable(logging.CRITICAL)
+    baseline = json.loads(compare.read_text())['results'] if compare else {}
+
+    results = {}
+    for name in names:
+        result = results[name] = benchmarks.suite.run_case(name, repeat)
+        click.echo(
+            f'{name: <40} {result["per_op_us"]:10.2f} µs/op {result["ops_per_s"]:12.0f} ops/s'
+            f'{comparison(result, baseline.get(name))}'
+        )
+
+    if output:
+        report = {
+            'when': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'revision': revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results,
+        }
+        output.write_text(json.dumps(report, indent=4) + '\n')
+
+
+if __name__ == '__main__':
+    command()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# benchmarks/allocation.py
+# copyright 2024 Kuupa Ork <kuupaork+github@hfdl.observer>
+# see LICENSE (or https://github.com/hfdl-observer/hfdlobserver888/blob/main/LICENSE) for terms of use.
+# TL;DR: BSD 3-clause
+#
+# Compares the conductor's allocators on system table snapshots: how much of the (rank weighted) active frequencies
+# the receivers cover, and what each allocation costs. Active frequencies are sampled from each table as the remote
+# station updates would report them.
+#
+#   $ python3 -m benchmarks.allocation [--receivers N ...] [--samples N] [<systable.conf> ...]
+
+import pathlib
+import time
+
+import click
+
+import benchmarks  # noqa: F401  # sets up the path
+import benchmarks.synthetic
+import hfdl_observer.bus
+import hfdl_observer.manage
+
+ALLOCATORS = ('greedy', 'coverage')
+
+
+def conductor(
+    allocator: str,
+    station_ids: list[int],
+    receivers: int,
+    slot_width: int,
+) -> hfdl_observer.manage.SimpleConductor:
+    result = hfdl_observer.manage.SimpleConductor({
+        'ranked_stations': station_ids,
+        'slot_width': slot_width,
+        'allocator': allocator,
+    })
+    remote = hfdl_observer.bus.Publisher()
+    for ix in range(receivers):
+        result.add_receiver(hfdl_observer.manage.ReceiverProxy(f'observer-{ix + 1:02}', slot_width, remote))
+    return result
+
+
+def coverage(
+    conductor: hfdl_observer.manage.SimpleConductor,
+    station_frequencies: dict[int, list[int]],
+) -> tuple[float, float, float]:
+    # the weighted coverage, the frequencies covered, and the best time for an allocation.
+    best = float('inf')
+    for _ in range(3):
+        start = time.perf_counter()
+        allocations = conductor.allocate_frequencies(station_frequencies)
+        best = min(best, time.perf_counter() - start)
+    weights: dict[int, int] = {}
+    ranked = len(conductor.ranked_station_ids)
+    for rank, sid in enumerate(conductor.ranked_station_ids):
+        for frequency in station_frequencies.get(sid, []):
+            weights[frequency] = weights.get(frequency, 0) + ranked - rank
+    covered = set(f for allocation in allocations[:len(conductor.proxies)] for f in allocation.frequencies)
+    total = sum(weights.values()) or 1
+    return sum(weights[f] for f in covered) / total, len(covered) / (len(weights) or 1), best
+
+
+@click.command
+@click.option('--receivers', help='receiver counts to compare', multiple=True, type=int, default=[4, 8, 13])
+@click.option('--slot-width', help='receiver bandwidth (kHz)', default=12)
+@click.option('--samples', help='active frequency samples per table', default=20)
+@click.argument('systables', nargs=-1, type=click.Path(path_type=pathlib.Path, exists=True))
+def command(receivers: list[int], slot_width: int, samples: int, systables: list[pathlib.Path]) -> None:
+    for path in systables or [benchmarks.synthetic.SYSTABLE_PATH]:
+        stations = benchmarks.synthetic.load_stations(path)
+        station_ids = sorted(stations)
+        click.echo(f'{path}: {len(stations)} stations')
+        for count in receivers:
+            for allocator in ALLOCATORS:
+                results = []
+                subject = conductor(allocator, station_ids, count, slot_width)
+                for seed in range(samples):
+                    generator = benchmarks.synthetic.PacketGenerator(seed=seed, stations=stations)
+                    active = {
+                        gs['id']: gs['frequencies']['active'] for gs in generator.active_stations()['ground_stations']
+                    }
+                    results.append(coverage(subject, active))
+                weighted, covered, elapsed = (sum(r[ix] for r in results) / len(results) for ix in range(3))
+                click.echo(
+                    f'  {count:3} receivers {allocator: <9} weighted {weighted * 100:5.1f}%'
+                    f' frequencies {covered * 100:5.1f}% {elapsed * 1e6:8.1f} µs/allocation'
+                )
+
+
+if __name__ == '__main__':
+    command()
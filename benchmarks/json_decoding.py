@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# benchmarks/json_decoding.py
+# copyright 2024 Kuupa Ork <kuupaork+github@hfdl.observer>
+# see LICENSE (or https://github.com/hfdl-observer/hfdlobserver888/blob/main/LICENSE) for terms of use.
+# TL;DR: BSD 3-clause
+#
+# Compares the available JSON decoder backends on recorded dumphfdl packet logs (the `packetlog` decoder option).
+#
+#   $ python3 -m benchmarks.json_decoding [--repeat N] <packetlog> [<packetlog> ...]
+
+import pathlib
+import time
+
+import click
+
+import benchmarks  # noqa: F401  # sets up the path
+import hfdl_observer.codec
+import hfdl_observer.replay
+
+
+def time_decoder(decoder: hfdl_observer.codec.JSONDecoder, lines: list[str], repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            try:
+                decoder(line)
+            except hfdl_observer.codec.DECODE_ERRORS:
+                pass
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+@click.command
+@click.option('--repeat', help='timing runs per decoder (best is reported)', default=5)
+@click.argument('packetlogs', nargs=-1, required=True, type=click.Path(path_type=pathlib.Path, exists=True))
+def command(repeat: int, packetlogs: list[pathlib.Path]) -> None:
+    lines = list(hfdl_observer.replay.packet_log_lines(packetlogs))  # type: ignore
+    if not lines:
+        raise click.ClickException('no packets found')
+    size = sum(len(line) for line in lines)
+    click.echo(f'{len(lines)} packets, {size / len(lines):.0f} bytes average')
+
+    baseline = None
+    for name in hfdl_observer.codec.available_decoders():
+        elapsed = time_decoder(hfdl_observer.codec.DECODERS[name](), lines, repeat)  # type: ignore
+        baseline = baseline or elapsed
+        click.echo(
+            f'{name: <14} {elapsed * 1e6 / len(lines):8.2f} µs/packet'
+            f' {len(lines) / elapsed:10.0f} packets/s  x{baseline / elapsed:.2f}'
+        )
+
+
+if __name__ == '__main__':
+    command()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# benchmarks/loop_lag.py
+# copyright 2024 Kuupa Ork <kuupaork+github@hfdl.observer>
+# see LICENSE (or https://github.com/hfdl-observer/hfdlobserver888/blob/main/LICENSE) for terms of use.
+# TL;DR: BSD 3-clause
+#
+# Measures event loop lag in the HFDL listener under a synthetic 13-receiver UDP load, decoding on the loop and in
+# a pool of decode workers.
+#
+#   $ python3 -m benchmarks.loop_lag [--rate 2000] [--duration 10] [--workers 2]
+
+import asyncio
+import multiprocessing
+import socket
+import statistics
+import time
+
+import click
+
+import benchmarks.synthetic
+import hfdl_observer.hfdl
+import hfdl_observer.listeners
+
+
+PROBE_INTERVAL = 0.005
+
+
+def send_load(port: int, rate: float, duration: float, receivers: int) -> None:
+    # runs in its own process: each "receiver" has its own socket, as each dumphfdl does.
+    generator = benchmarks.synthetic.PacketGenerator(rate=rate)
+    lines = [(line + '\n').encode() for line in generator.lines(int(rate * duration))]
+    sockets = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(receivers)]
+    start = time.monotonic()
+    for ix, line in enumerate(lines):
+        delay = start + ix / rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        sockets[ix % receivers].sendto(line, ('127.0.0.1', port))
+
+
+async def measure(port: int, rate: float, duration: float, workers: int, receivers: int) -> dict:
+    received = 0
+
+    def on_packet(packet: hfdl_observer.hfdl.HFDLPacketInfo) -> None:
+        nonlocal received
+        received += 1
+        packet.position
+
+    listener = hfdl_observer.listeners.HFDLListener({'address': '127.0.0.1', 'port': port, 'decode_workers': workers})
+    consumer = hfdl_observer.listeners.HFDLPacketConsumer.for_types(hfdl_observer.hfdl.PacketType.ANY, [on_packet])
+    listener.start([consumer])
+    await asyncio.sleep(1)  # let the socket (and any workers) come up.
+
+    sender = multiprocessing.get_context('spawn').Process(target=send_load, args=(port, rate, duration, receivers))
+    sender.start()
+    lags = []
+    loop = asyncio.get_running_loop()
+    while sender.is_alive():
+        before = loop.time()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(loop.time() - before - PROBE_INTERVAL)
+    previous = -1
+    while received != previous:  # drain
+        previous = received
+        await asyncio.sleep(0.5)
+    listener.stop()
+    lags.sort()
+    return {
+        'workers': workers,
+        'sent': int(rate * duration),
+        'received': received,
+        'queue_dropped': listener.queue.dropped,
+        'queue_max_depth': listener.queue.max_depth,
+        'lag_p50_ms': statistics.median(lags) * 1000,
+        'lag_p99_ms': lags[int(len(lags) * 0.99)] * 1000,
+        'lag_max_ms': lags[-1] * 1000,
+    }
+
+
+@click.command
+@click.option('--rate', help='packets per second, across all receivers', default=2000.0)
+@click.option('--duration', help='seconds of load', default=10.0)
+@click.option('--workers', help='decode workers for the pooled run', default=2)
+@click.option('--receivers', help='number of simulated receivers', default=13)
+@click.option('--port', help='UDP port to listen on', default=5599)
+def command(rate: float, duration: float, workers: int, receivers: int, port: int) -> None:
+    for worker_count in [0, workers]:
+        result = asyncio.run(measure(port, rate, duration, worker_count, receivers))
+        click.echo(
+            f'workers={result["workers"]}: received {result["received"]}/{result["sent"]}'
+            f' (queue dropped {result["queue_dropped"]}, max depth {result["queue_max_depth"]})'
+            f'  loop lag p50 {result["lag_p50_ms"]:.2f}ms p99 {result["lag_p99_ms"]:.2f}ms'
+            f' max {result["lag_max_ms"]:.2f}ms'
+        )
+
+
+if __name__ == '__main__':
+    command()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# benchmarks/remote_refresh.py
+# copyright 2024 Kuupa Ork <kuupaork+github@hfdl.observer>
+# see LICENSE (or https://github.com/hfdl-observer/hfdlobserver888/blob/main/LICENSE) for terms of use.
+# TL;DR: BSD 3-clause
+#
+# Checks the remote station refresher against a local HTTP stand-in for the station update service: conditional
+# requests (ETag, If-Modified-Since) answered with 304, the content hash check for servers without validators,
+# and that stations stamped relative to the fetch stay current while the document is unchanged.
+#
+#   $ python3 -m benchmarks.remote_refresh
+
+import asyncio
+import hashlib
+import http.server
+import json
+import threading
+import time
+
+from typing import Any, Optional
+
+import click
+
+import benchmarks  # noqa: F401  # sets up the path
+import hfdl_observer.bus
+import hfdl_observer.groundstation
+
+
+class StandIn(http.server.BaseHTTPRequestHandler):
+    # serves `document`, with validators only if `validators` is set. Requests are recorded in `requests`.
+    document: bytes = b''
+    validators = True
+    last_modified = 'Mon, 07 Oct 2024 12:00:00 GMT'
+    requests: list[dict[str, Optional[str]]] = []
+
+    def do_GET(self) -> None:
+        etag = f'"{hashlib.sha256(self.document).hexdigest()[:16]}"'
+        self.requests.append({
+            'If-None-Match': self.headers.get('If-None-Match'),
+            'If-Modified-Since': self.headers.get('If-Modified-Since'),
+        })
+        if self.validators and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.document)))
+        if self.validators:
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', self.last_modified)
+        self.end_headers()
+        self.wfile.write(self.document)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+def station_document(last_updated: int, frequencies: list[int]) -> bytes:
+    return json.dumps({'ground_stations': [{
+        'id': 1,
+        'name': 'San Francisco, California',
+        'last_updated': last_updated,
+        'frequencies': {'active': frequencies},
+    }]}).encode()
+
+
+async def poll(refresher: hfdl_observer.bus.RemoteURLRefresher, published: list[str]) -> str:
+    # what one poll published.
+    del published[:]
+    await refresher.execute()
+    await asyncio.sleep(0)
+    return ','.join(published) or 'nothing'
+
+
+async def check(url: str) -> list[tuple[str, bool]]:
+    results = []
+    published: list[str] = []
+    refresher = hfdl_observer.bus.RemoteURLRefresher(url, timeout=5)
+    table = hfdl_observer.groundstation.AirframesStationTable()
+    refresher.subscribe('response', table.update)
+    refresher.subscribe('unchanged', table.refresh)
+    refresher.subscribe('response', lambda _: published.append('response'))
+    refresher.subscribe('unchanged', lambda _: published.append('unchanged'))
+
+    StandIn.document = station_document(-60, [5451, 10081])
+    results.append(('first fetch is published', await poll(refresher, published) == 'response'))
+    first_stamp = table[1].last_updated
+    results.append(('ETag is remembered', refresher.etag is not None))
+    results.append(('Last-Modified is remembered', refresher.last_modified == StandIn.last_modified))
+
+    time.sleep(1.1)  # so that a relative stamp moves on.
+    results.append(('unchanged document is not re-published', await poll(refresher, published) == 'unchanged'))
+    request = StandIn.requests[-1]
+    results.append(('If-None-Match is sent', request['If-None-Match'] == refresher.etag))
+    results.append(('If-Modified-Since is sent', request['If-Modified-Since'] == StandIn.last_modified))
+    results.append(('relative stamps are renewed on 304', table[1].last_updated > first_stamp))
+
+    StandIn.document = station_document(-60, [5451, 13276])
+    results.append(('changed document is published', await poll(refresher, published) == 'response'))
+    results.append(('changed frequencies are applied', sorted(table[1].khz()) == [5451, 13276]))
+
+    StandIn.validators = False
+    refresher.etag = refresher.last_modified = None
+    results.append(('same content without validators is not re-published',
+                    await poll(refresher, published) == 'unchanged'))
+
+    StandIn.document = station_document(int(time.time()) - 60, [5451, 13276])
+    results.append(('absolute stamps are published once', await poll(refresher, published) == 'response'))
+    stamp = table[1].last_updated
+    await poll(refresher, published)
+    results.append(('absolute stamps are left alone when unchanged', table[1].last_updated == stamp))
+    return results
+
+
+@click.command
+def command() -> None:
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        results = asyncio.run(check(f'http://127.0.0.1:{server.server_address[1]}/active.json'))
+    finally:
+        server.shutdown()
+    for description, passed in results:
+        click.echo(f'{"ok  " if passed else "FAIL"} {description}')
+    if not all(passed for _, passed in results):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    command()
@@ -0,0 +1,379 @@
+# benchmarks/suite.py
+# copyright 2024 Kuupa Ork <kuupaork+github@hfdl.observer>
+# see LICENSE (or https://github.com/hfdl-observer/hfdlobserver888/blob/main/LICENSE) for terms of use.
+# TL;DR: BSD 3-clause
+#
+# Micro-benchmarks for the observer's hot paths, fed by the synthetic packet generator. Each case is a setup
+# function that prepares its fixtures (untimed) and returns the body to be timed; `ops` is the number of
+# operations the body performs, for per-operation figures.
+
+import asyncio
+import io
+import itertools
+import json
+import statistics
+import time
+
+from typing import Any, Callable
+
+import rich.console
+
+import benchmarks.synthetic
+import hfdl_observer.bus
+import hfdl_observer.groundstation
+import hfdl_observer.hfdl
+import hfdl_observer.libconfig
+import hfdl_observer.listeners
+import hfdl_observer.manage
+
+import cui
+import packet_stats
+
+
+PACKETS = 5000
+CALLS = 200
+RECEIVERS = 13
+# overall packet rate for the packet counter histories, per second, across all receivers.
+HISTORY_RATE = 1.0
+DAY = 86400
+BIN_CALLS = 3
+
+Body = Callable[[], Any]
+Setup = Callable[[], Body]
+CASES: dict[str, tuple[Setup, int]] = {}
+
+
+def case(name: str, ops: int) -> Callable[[Setup], Setup]:
+    def register(setup: Setup) -> Setup:
+        CASES[name] = (setup, ops)
+        return setup
+    return register
+
+
+def settle() -> None:
+    # the tables publish as they go; run what they scheduled so it does not pile up between runs.
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(asyncio.sleep(0))
+
+
+def run_case(name: str, repeat: int) -> dict[str, Any]:
+    setup, ops = CASES[name]
+    body = setup()
+    settle()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body()
+        timings.append(time.perf_counter() - start)
+        settle()
+    best = min(timings)
+    return {
+        'ops': ops,
+        'repeat': repeat,
+        'best_s': best,
+        'median_s': statistics.median(timings),
+        'per_op_us': best * 1e6 / ops,
+        'ops_per_s': ops / best,
+    }
+
+
+def recent_generator(count: int, rate: float = 10.0) -> benchmarks.synthetic.PacketGenerator:
+    # packets that end about now, so nothing the tables hold has already expired.
+    return benchmarks.synthetic.PacketGenerator(start=time.time() - count / rate, rate=rate)
+
+
+def packet_infos(count: int, kind: str = '') -> list[hfdl_observer.hfdl.HFDLPacketInfo]:
+    generator = recent_generator(count)
+    if kind:
+        generator.mix = {kind: 1}
+        generator.kinds, generator.weights = [kind], [1]
+    return [hfdl_observer.hfdl.HFDLPacketInfo(p) for p in generator.packets(count)]
+
+
+def packet_history(horizon: int) -> packet_stats.BinnedPacketCounter:
+    generator = recent_generator(0)
+    frequencies = sorted(itertools.chain.from_iterable(s['frequencies'] for s in generator.stations.values()))
+    observed = frequencies[::max(1, len(frequencies) // (RECEIVERS * 3))]
+    counter = packet_stats.BinnedPacketCounter()
+    counter.horizon = 7 * DAY
+    now = time.time()
+    count = int(horizon * HISTORY_RATE)
+    counter.samples = sorted(
+        packet_stats.Sample(now - generator.random.uniform(0, horizon), generator.random.choice(observed), 10.0)
+        for _ in range(count)
+    )
+    counter.observed_frequencies = observed
+    for sid, station in generator.stations.items():
+        for frequency in station['frequencies']:
+            counter.observed_stations[frequency] = {'id': sid, 'name': station['name']}
+    return counter
+
+
+def ground_station_status() -> hfdl_observer.groundstation.GroundStationStatus:
+    generator = recent_generator(PACKETS)
+    status = hfdl_observer.groundstation.GroundStationStatus()
+    systable = hfdl_observer.groundstation.SystemTable()
+    systable.update(benchmarks.synthetic.SYSTABLE_PATH.read_text())
+    airframes = hfdl_observer.groundstation.AirframesStationTable()
+    airframes.update(generator.active_stations())
+    squitters = hfdl_observer.groundstation.SquitterTable()
+    updates = hfdl_observer.groundstation.UpdateTable()
+    for packet in generator.packets(PACKETS):
+        info = hfdl_observer.hfdl.HFDLPacketInfo(packet)
+        squitters.update(info)
+        updates.update(info)
+    for table in [squitters, updates, airframes, systable]:  # in the order ActiveGroundStations adds them
+        status.add_table(table)
+    return status
+
+
+def conductor_fixtures() -> tuple[hfdl_observer.manage.SimpleConductor, dict[int, list[int]], dict[int, list[int]]]:
+    generator = recent_generator(0)
+    active = {gs['id']: gs['frequencies']['active'] for gs in generator.active_stations()['ground_stations']}
+    inactive = {
+        sid: [f for f in station['frequencies'] if f not in active.get(sid, [])]
+        for sid, station in generator.stations.items()
+    }
+    conductor = hfdl_observer.manage.SimpleConductor({'ranked_stations': list(generator.station_ids), 'slot_width': 12})
+    remote = hfdl_observer.bus.Publisher()
+    for ix in range(RECEIVERS):
+        conductor.add_receiver(hfdl_observer.manage.ReceiverProxy(f'observer-{ix + 1:02}', 12, remote))
+    return conductor, active, inactive
+
+
+@case('udp.datagram_received', PACKETS)
+def udp_datagram_received() -> Body:
+    datagrams = [
+        ((line + '\n').encode(), ('127.0.0.1', 40000 + ix % RECEIVERS))
+        for ix, line in enumerate(recent_generator(PACKETS).lines(PACKETS))
+    ]
+
+    def body() -> None:
+        protocol = hfdl_observer.listeners.UDPProtocol(hfdl_observer.listeners.IngestQueue(PACKETS))
+        receive = protocol.datagram_received
+        for data, addr in datagrams:
+            receive(data, addr)  # type: ignore
+    return body
+
+
+@case('listener.decode_dispatch', PACKETS)
+def listener_decode_dispatch() -> Body:
+    lines = [(line, 'bench') for line in recent_generator(PACKETS).lines(PACKETS)]
+    PacketType = hfdl_observer.hfdl.PacketType
+
+    def noop(packet: hfdl_observer.hfdl.HFDLPacketInfo) -> None:
+        pass
+    # consumers shaped like the observer's own.
+    dispatcher = hfdl_observer.listeners.HFDLPacketDispatcher([
+        hfdl_observer.listeners.HFDLPacketConsumer.for_types(PacketType.SQUITTER | PacketType.PERFORMANCE, [noop]),
+        hfdl_observer.listeners.HFDLPacketConsumer.for_types(PacketType.ANY, [noop]),
+    ])
+    stage = hfdl_observer.listeners.DecodeStage(dispatcher)
+
+    def body() -> None:
+        stage.submit(lines)
+    return body
+
+
+@case('listener.duplicate_filter', 2 * PACKETS)
+def listener_duplicate_filter() -> Body:
+    # every frame heard twice, by neighbouring receivers.
+    lines = list(recent_generator(PACKETS).lines(PACKETS))
+    packets = [(line, hfdl_observer.hfdl.HFDLPacketInfo(json.loads(line))) for line in lines]
+    sources = [f'127.0.0.1:{40000 + ix}' for ix in range(RECEIVERS + 1)]
+
+    def body() -> None:
+        duplicates = hfdl_observer.listeners.DuplicateFilter()
+        is_duplicate = duplicates.is_duplicate
+        for ix, (line, packet) in enumerate(packets):
+            is_duplicate(line, packet, sources[ix % RECEIVERS])
+            is_duplicate(line, packet, sources[ix % RECEIVERS + 1])
+    return body
+
+
+@case('stream_watcher.lines', PACKETS)
+def stream_watcher_lines() -> Body:
+    # a child process's output, already buffered, as from dumphfdl with `quiet: False`.
+    data = ''.join(line + '\n' for line in recent_generator(PACKETS).lines(PACKETS)).encode()
+    loop = asyncio.get_event_loop()
+
+    def noop(_: Any) -> None:
+        pass
+
+    def body() -> None:
+        stream = asyncio.StreamReader(limit=len(data) + 1)
+        stream.feed_data(data)
+        stream.feed_eof()
+        watcher = hfdl_observer.bus.StreamWatcher(stream)
+        watcher.subscribe('line', noop)
+        watcher.subscribe('lines', noop)
+        watcher.enabled = True
+        loop.run_until_complete(watcher.run())
+    return body
+
+
+@case('packet_info.construct', PACKETS)
+def packet_info_construct() -> Body:
+    packets = list(recent_generator(PACKETS).packets(PACKETS))
+
+    def body() -> None:
+        for packet in packets:
+            hfdl_observer.hfdl.HFDLPacketInfo(packet)
+    return body
+
+
+@case('packet_info.position', PACKETS)
+def packet_info_position() -> Body:
+    packets = list(recent_generator(PACKETS).packets(PACKETS))
+
+    def body() -> None:
+        for packet in packets:
+            hfdl_observer.hfdl.HFDLPacketInfo(packet).position
+    return body
+
+
+@case('squitter_table.update', PACKETS)
+def squitter_table_update() -> Body:
+    squitters = packet_infos(PACKETS, 'squitter')
+
+    def body() -> None:
+        table = hfdl_observer.groundstation.SquitterTable()
+        for packet in squitters:
+            table.update(packet)
+    return body
+
+
+@case('squitter_table.update.repeated', 3 * PACKETS)
+def squitter_table_update_repeated() -> Body:
+    # as broadcast: each squitter sent on three frequencies at once.
+    squitters = [packet for packet in packet_infos(PACKETS, 'squitter') for _ in range(3)]
+
+    def body() -> None:
+        table = hfdl_observer.groundstation.SquitterTable()
+        for packet in squitters:
+            table.update(packet)
+    return body
+
+
+@case('system_table.parse', CALLS)
+def system_table_parse() -> Body:
+    text = benchmarks.synthetic.SYSTABLE_PATH.read_text()
+
+    def body() -> None:
+        for _ in range(CALLS):
+            hfdl_observer.libconfig.Parser(text).document()
+    return body
+
+
+@case('system_table.update', CALLS)
+def system_table_update() -> Body:
+    # as on a refresh of an unchanged file.
+    text = benchmarks.synthetic.SYSTABLE_PATH.read_text()
+    table = hfdl_observer.groundstation.SystemTable()
+
+    def body() -> None:
+        for _ in range(CALLS):
+            table.update(text)
+    return body
+
+
+@case('ground_station_status.populate_strata', CALLS)
+def populate_strata() -> Body:
+    status = ground_station_status()
+
+    def body() -> None:
+        for _ in range(CALLS):
+            status.populate_strata()
+    return body
+
+
+@case('ground_station_status.squitter', PACKETS)
+def ground_station_status_squitter() -> Body:
+    # squitters through a table watched by the status, each handled (strata and all) before the next.
+    status = ground_station_status()
+    table = next(iter(status.tables))
+    squitters = packet_infos(PACKETS, 'squitter')
+    loop = asyncio.get_event_loop()
+
+    def body() -> None:
+        for packet in squitters:
+            table.update(packet)
+            loop.run_until_complete(asyncio.sleep(0))
+    return body
+
+
+@case('conductor.allocate_frequencies', CALLS)
+def conductor_allocate_frequencies() -> Body:
+    conductor, active, inactive = conductor_fixtures()
+
+    def body() -> None:
+        for _ in range(CALLS):
+            allocations = conductor.allocate_frequencies(active)
+            conductor.allocate_frequencies(inactive, allocations)
+    return body
+
+
+@case('conductor.allocate_frequencies.coverage', CALLS)
+def conductor_allocate_frequencies_coverage() -> Body:
+    conductor, active, inactive = conductor_fixtures()
+    conductor.config['allocator'] = 'coverage'
+
+    def body() -> None:
+        for _ in range(CALLS):
+            allocations = conductor.allocate_frequencies(active)
+            conductor.allocate_frequencies(inactive, allocations)
+    return body
+
+
+@case('conductor.orchestrate', CALLS)
+def conductor_orchestrate() -> Body:
+    conductor, active, inactive = conductor_fixtures()
+    allocations = conductor.allocate_frequencies(active)
+    field_allocations = conductor.allocate_frequencies(inactive, allocations)
+    # steady state: the receivers already listen where the conductor wants them.
+    for proxy, allocation in zip(conductor.proxies, field_allocations):
+        proxy.on_remote_event(('listening', allocation.frequencies))
+
+    def body() -> None:
+        for _ in range(CALLS):
+            conductor.orchestrate(allocations, field_allocations)
+    return body
+
+
+def packet_counter_bins(horizon: int) -> Body:
+    counter = packet_history(horizon)
+
+    def body() -> None:
+        for _ in range(BIN_CALLS):
+            counter.bins(-horizon, 60)
+    return body
+
+
+@case('packet_counter.bins.1d', BIN_CALLS)
+def packet_counter_bins_day() -> Body:
+    return packet_counter_bins(DAY)
+
+
+@case('packet_counter.bins.7d', BIN_CALLS)
+def packet_counter_bins_week() -> Body:
+    return packet_counter_bins(7 * DAY)
+
+
+@case('ticker.render', CALLS)
+def ticker_render() -> Body:
+    console = rich.console.Console(file=io.StringIO(), width=200, height=60)
+    ticker = cui.Ticker({'bin_size': 60})
+    ticker.register_packet_counter(packet_history(DAY))
+    forecaster = hfdl_observer.bus.RemoteURLRefresher('http://localhost/', 60)
+    cui.ObserverDisplay(console, ticker, cui.CumulativeLine(), forecaster)
+
+    def body() -> None:
+        for _ in range(CALLS):
+            ticker.render()
+    return body
+
+
+def matching(patterns: list[str]) -> list[str]:
+    if not patterns:
+        return list(CASES)
+    return [name for name in CASES if any(name.startswith(p) for p in patterns)]
@@ -0,0 +1,189 @@
+# benchmarks/synthetic.py
+# copyright 2024 Kuupa Ork <kuupaork+github@hfdl.observer>
+# see LICENSE (or https://github.com/hfdl-observer/hfdlobserver888/blob/main/LICENSE) for terms of use.
+# TL;DR: BSD 3-clause
+#
+# A deterministic generator of dumphfdl-shaped JSON packets, for benchmarks that need traffic without a Web-888.
+# Stations and frequencies come from the system table shipped with the observer.
+
+import json
+import pathlib
+import random
+
+from typing import Any, Iterator, Optional
+
+import benchmarks  # noqa: F401  # sets up the path
+import hfdl_observer.groundstation
+
+
+SYSTABLE_PATH = pathlib.Path(__file__).parent.parent / 'systable.conf'
+START_TIME = 1700000000
+# relative weights of the kinds of packets generated, roughly as observed on a busy day.
+DEFAULT_MIX = {
+    'squitter': 30,
+    'performance': 15,
+    'position': 25,
+    'uplink': 20,
+    'other': 10,
+}
+
+
+def load_stations(path: pathlib.Path = SYSTABLE_PATH) -> dict[int, dict[str, Any]]:
+    table = hfdl_observer.groundstation.SystemTable()
+    table.update(path.read_text())
+    return {
+        station.id: {'id': station.id, 'name': station.name, 'frequencies': sorted(station.khz())}
+        for station in table.stations(None)
+    }
+
+
+class PacketGenerator:
+    stations: dict[int, dict[str, Any]]
+    when: float
+
+    def __init__(
+        self,
+        seed: int = 888,
+        start: float = START_TIME,
+        rate: float = 10.0,
+        mix: Optional[dict[str, int]] = None,
+        stations: Optional[dict[int, dict[str, Any]]] = None,
+    ) -> None:
+        self.random = random.Random(seed)
+        self.when = start
+        self.rate = rate  # packets per second, on average
+        self.mix = mix or DEFAULT_MIX
+        self.stations = stations or load_stations()
+        self.station_ids = sorted(self.stations)
+        self.kinds = list(self.mix.keys())
+        self.weights = list(self.mix.values())
+
+    def station_ref(self, station: dict[str, Any]) -> dict[str, Any]:
+        return {'type': 'Ground station', 'id': station['id'], 'name': station['name']}
+
+    def aircraft_ref(self) -> dict[str, Any]:
+        return {
+            'type': 'Aircraft',
+            'id': self.random.randrange(1, 255),
+            'ac_info': {'icao': f'{self.random.randrange(0xffffff):06X}'},
+        }
+
+    def envelope(self, frequency: int, pdu_key: str, pdu: dict[str, Any]) -> dict[str, Any]:
+        sig_level = self.random.uniform(-40.0, -10.0)
+        return {
+            'hfdl': {
+                'app': {'name': 'dumphfdl', 'ver': '1.6.1'},
+                'station': 'XX-BENCH',
+                't': {'sec': int(self.when), 'usec': int((self.when % 1) * 1e6)},
+                'freq': frequency * 1000,
+                'bit_rate': self.random.choice([300, 600, 1200, 1800]),
+                'sig_level': sig_level,
+                'noise_level': sig_level - self.random.uniform(3.0, 25.0),
+                'freq_skew': self.random.uniform(-5.0, 5.0),
+                'slot': self.random.choice(['S', 'D']),
+                pdu_key: pdu,
+            }
+        }
+
+    def squitter(self, station: dict[str, Any], frequency: int) -> dict[str, Any]:
+        gs_status = []
+        for sid in self.random.sample(self.station_ids, 3) + [station['id']]:
+            other = self.stations[sid]
+            freqs = self.random.sample(other['frequencies'], min(len(other['frequencies']), 4))
+            gs_status.append({
+                'gs': self.station_ref(other),
+                'utc_sync': True,
+                'freqs': [{'id': ix, 'freq': float(f)} for ix, f in enumerate(sorted(freqs))],
+            })
+        return self.envelope(frequency, 'spdu', {
+            'err': False,
+            'src': self.station_ref(station),
+            'spdu_version': 0,
+            'change_note': 'None',
+            'frame_index': self.random.randrange(0, 4096),
+            'frame_offset': 0,
+            'min_priority': 0,
+            'systable_version': 52,
+            'gs_status': gs_status,
+        })
+
+    def lpdu(self, src: dict[str, Any], dst: dict[str, Any], hfnpdu: Optional[dict[str, Any]]) -> dict[str, Any]:
+        lpdu: dict[str, Any] = {
+            'err': False,
+            'src': src,
+            'dst': dst,
+            'type': {'id': 13, 'name': 'Unnumbered data'},
+        }
+        if hfnpdu:
+            lpdu['hfnpdu'] = hfnpdu
+        return lpdu
+
+    def performance(self, station: dict[str, Any], frequency: int) -> dict[str, Any]:
+        freq_data = []
+        for sid in self.random.sample(self.station_ids, 2) + [station['id']]:
+            other = self.stations[sid]
+            heard = [{'id': ix, 'freq': float(f)} for ix, f in enumerate(other['frequencies'][:2])]
+            freq_data.append({'gs': self.station_ref(other), 'listening_on_freqs': heard, 'heard_on_freqs': heard})
+        return self.envelope(frequency, 'lpdu', self.lpdu(self.aircraft_ref(), self.station_ref(station), {
+            'err': False,
+            'type': {'id': 209, 'name': 'Performance data'},
+            'flight_id': f'BNC{self.random.randrange(1, 9999)}',
+            'pos': {'lat': self.random.uniform(-80, 80), 'lon': self.random.uniform(-180, 180)},
+            'freq_data': freq_data,
+        }))
+
+    def position(self, station: dict[str, Any], frequency: int) -> dict[str, Any]:
+        report = {
+            'lat': self.random.uniform(-80, 80),
+            'lon': self.random.uniform(-180, 180),
+            'alt': self.random.randrange(20000, 41000),
+        }
+        return self.envelope(frequency, 'lpdu', self.lpdu(self.aircraft_ref(), self.station_ref(station), {
+            'err': False,
+            'type': {'id': 255, 'name': 'Enveloped data'},
+            'acars': {
+                'err': False,
+                'reg': f'.N{self.random.randrange(100, 999)}XX',
+                'label': 'H1',
+                'arinc622': {'msg_type': 'adsc_report', 'adsc': {'tags': [{'basic_report': report}]}},
+            },
+        }))
+
+    def uplink(self, station: dict[str, Any], frequency: int) -> dict[str, Any]:
+        return self.envelope(frequency, 'lpdu', self.lpdu(self.station_ref(station), self.aircraft_ref(), {
+            'err': False,
+            'type': {'id': 255, 'name': 'Enveloped data'},
+            'acars': {'err': False, 'reg': '.N123XX', 'label': '_d', 'msg_text': ''},
+        }))
+
+    def other(self, station: dict[str, Any], frequency: int) -> dict[str, Any]:
+        return self.envelope(frequency, 'lpdu', self.lpdu(self.aircraft_ref(), self.station_ref(station), None))
+
+    def packet(self) -> dict[str, Any]:
+        self.when += self.random.expovariate(self.rate)
+        station = self.stations[self.random.choice(self.station_ids)]
+        frequency = self.random.choice(station['frequencies'])
+        kind = self.random.choices(self.kinds, self.weights)[0]
+        return getattr(self, kind)(station, frequency)  # type: ignore
+
+    def packets(self, count: int) -> Iterator[dict[str, Any]]:
+        for _ in range(count):
+            yield self.packet()
+
+    def lines(self, count: int) -> Iterator[str]:
+        for packet in self.packets(count):
+            yield json.dumps(packet)
+
+    def active_stations(self) -> dict[str, Any]:
+        # shaped like the remote `active.json` station updates.
+        ground_stations = []
+        for sid in self.station_ids:
+            station = self.stations[sid]
+            active = self.random.sample(station['frequencies'], min(len(station['frequencies']), 3))
+            ground_stations.append({
+                'id': sid,
+                'name': station['name'],
+                'last_updated': int(self.when) - self.random.randrange(0, 600),
+                'frequencies': {'active': sorted(active)},
+            })
+        return {'ground_stations': ground_stations}
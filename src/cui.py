@@ -24,6 +24,7 @@ import rich.table
 import rich.text
 
 import hfdl_observer.hfdl
+import hfdl_observer.replay
 
 import main
 import packet_stats
@@ -272,7 +273,14 @@ class Ticker(packet_stats.PacketCountRenderer):
                 row_text = rich.text.Text(style=SUBDUED_TEXT)
                 row_text.append(f'{data["state"]: ^3}', style=PROMINENT_TEXT)
                 station = self.packet_counter.observed_stations[freq]
-                sid = station['id'] or hfdl_observer.hfdl.STATIONS.get(int(freq), {}).get('id', 0)
+                sid = station['id']
+                if not sid:
+                    # only when the frequency is not shared; otherwise there is no telling which it is. A frequency
+                    # a kHz off the table's (by rounding) is close enough.
+                    candidates = hfdl_observer.hfdl.STATIONS.stations_on(freq) or [
+                        station for _, station in hfdl_observer.hfdl.STATIONS.near(freq, 1)
+                    ]
+                    sid = candidates[0]['id'] if len(candidates) == 1 else 0
                 sname = packet_stats.STATION_ABBREVIATIONS.get(sid, '')
                 if station.get('pending'):
                     row_text.append(f'{sname.lower(): >9}', style='grey50')
@@ -356,7 +364,11 @@ class RichLive(rich.live.Live):
         super().refresh()
 
 
-def screen(loghandler: Optional[logging.Handler], debug: bool = True) -> None:
+def screen(
+    loghandler: Optional[logging.Handler],
+    debug: bool = True,
+    packet_source: Optional[hfdl_observer.replay.PacketLogReplayer] = None,
+) -> None:
     cui_settings = settings.registry['cui']
     console = rich.console.Console()
     console.clear()
@@ -406,7 +418,7 @@ def screen(loghandler: Optional[logging.Handler], debug: bool = True) -> None:
             display.update_status,
             display.update,
         ]
-        main.observe(on_observer=observing)
+        main.observe(on_observer=observing, packet_source=packet_source)
 
 
 if __name__ == '__main__':
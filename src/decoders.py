@@ -87,10 +87,15 @@ class IQDecoder(BaseDecoder):
         except KeyError:
             pass
         # Add a special output that sends to our local listener. We could do this through pipes, but this may be
-        # simpler for multiple receivers, especially remote ones.
-        cmd.extend([
-            '--output', f'decoded:json:{self.listener.proto}:address={self.listener.address},port={self.listener.port}'
-        ])
+        # simpler for multiple receivers, especially remote ones. dumphfdl can only send to UDP or TCP; a Unix socket
+        # listener has to be fed by some other bridge.
+        if self.listener.proto in ('udp', 'tcp'):
+            cmd.extend([
+                '--output',
+                f'decoded:json:{self.listener.proto}:address={self.listener.address},port={self.listener.port}'
+            ])
+        else:
+            logger.warning(f'{self} cannot send to a {self.listener.proto} listener directly')
 
         # If we have a station ID, send to airframes (unless it's a private station ID starting with '*')
         if self.station_id and not self.station_id.startswith('*'):
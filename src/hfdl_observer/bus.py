@@ -6,34 +6,261 @@
 
 import asyncio
 import collections
+import hashlib
+import inspect
 import json
 import logging
 import pathlib
+import time
 
-from typing import Any, AsyncGenerator, Callable, Optional, Union
+from typing import Any, AsyncGenerator, Awaitable, Callable, Optional, Protocol, Sequence, Union
 
 import requests
 
+import hfdl_observer.watch
+
 
 logger = logging.getLogger(__name__)
 
+DROP_OLDEST = 'drop-oldest'
+DROP_NEWEST = 'drop-newest'
+ASYNC_QUEUE_SIZE = 256
+# by default, an async subscriber is reported slow when its backlog reaches this fraction of its queue, or when a
+# body waits (or its handling runs) longer than ASYNC_MAX_LAG seconds.
+ASYNC_SLOW_DEPTH = 0.5
+ASYNC_MAX_LAG = 5.0
+# how often watched files are checked when inotify is not available, and how long to let a write settle.
+FILE_POLL_INTERVAL = 2.0
+FILE_SETTLE_TIME = 0.1
+# streams are read this many bytes at a time, giving up the loop at least every STREAM_YIELD_INTERVAL seconds.
+STREAM_CHUNK_SIZE = 65536
+STREAM_YIELD_INTERVAL = 0.01
+# (connect, read) timeouts for remote refreshes, in seconds.
+HTTP_TIMEOUT = (10.0, 30.0)
+
+
+class BusMonitor(Protocol):
+    def published(self, publisher: 'Publisher', subject: str, subscribers: int) -> None:
+        ...
+
+    def coalesced(self, publisher: 'Publisher', subject: str, saved: int) -> None:
+        ...
+
+    def deliver(
+        self, publisher: 'Publisher', subject: str, subscriber: Callable, body: Any, published_at: Optional[float]
+    ) -> None:
+        ...
+
+
+# when set, every publish and delivery is reported to the monitor (see `hfdl_observer.metrics.BusMetrics`).
+monitor: Optional[BusMonitor] = None
+
 
 class Publisher:
     _subscribers: dict[str, list[Callable]]
+    # coalescing subjects, and their windows. See `coalesce`.
+    _coalescing: Optional[dict[str, float]] = None
+    _pending: dict[str, Any]
+    coalesced: collections.Counter[str]
 
     def __init__(self) -> None:
         self._subscribers = {}
 
-    def subscribe(self, subject: str, callback: Callable) -> None:
+    def subscribe(
+        self,
+        subject: str,
+        callback: Callable,
+        queue_size: int = ASYNC_QUEUE_SIZE,
+        overflow: str = DROP_OLDEST,
+        max_lag: float = ASYNC_MAX_LAG,
+        slow_depth: float = ASYNC_SLOW_DEPTH,
+    ) -> None:
+        # coroutine functions are run by their own worker, fed through a queue. See `AsyncSubscriber`.
+        if inspect.iscoroutinefunction(callback):
+            callback = AsyncSubscriber(self, subject, callback, queue_size, overflow, max_lag, slow_depth)
         if self._subscribers is None:
             self._subscribers = collections.defaultdict(list)
         self._subscribers.setdefault(subject, []).append(callback)
 
+    def unsubscribe(self, subject: str, callback: Callable) -> None:
+        # the callback as it was subscribed; a coroutine function's worker is stopped.
+        subscribers = (self._subscribers or {}).get(subject, [])
+        for subscriber in list(subscribers):
+            if subscriber == callback or (isinstance(subscriber, AsyncSubscriber) and subscriber.callback == callback):
+                subscribers.remove(subscriber)
+                if isinstance(subscriber, AsyncSubscriber):
+                    subscriber.stop()
+
+    def close(self) -> None:
+        # drops every subscriber, stopping the workers of coroutine subscribers.
+        for subscribers in (self._subscribers or {}).values():
+            for subscriber in subscribers:
+                if isinstance(subscriber, AsyncSubscriber):
+                    subscriber.stop()
+        self._subscribers = {}
+
+    def coalesce(self, subject: str, window: float = 0) -> None:
+        # Makes `subject` a state topic rather than an event topic: subscribers get only the latest body published,
+        # at most once per loop iteration (or per `window` seconds). Deliveries saved are counted in `coalesced`.
+        if self._coalescing is None:
+            self._coalescing = {}
+            self._pending = {}
+            self.coalesced = collections.Counter()
+        self._coalescing[subject] = window
+
     def publish(self, subject: str, body: Any) -> None:
+        if self._coalescing and subject in self._coalescing:
+            self.publish_coalesced(subject, body)
+            return
         loop = asyncio.get_event_loop()
-        for subscriber in (self._subscribers or {}).get(subject, []):
+        subscribers = (self._subscribers or {}).get(subject, [])
+        if monitor is not None:
+            monitor.published(self, subject, len(subscribers))
+            published_at = time.perf_counter()
+            for subscriber in subscribers:
+                loop.call_soon(monitor.deliver, self, subject, subscriber, body, published_at)
+            return
+        for subscriber in subscribers:
             loop.call_soon(subscriber, body)
 
+    def publish_coalesced(self, subject: str, body: Any) -> None:
+        subscribers = (self._subscribers or {}).get(subject)
+        if not subscribers:
+            return
+        if monitor is not None:
+            monitor.published(self, subject, len(subscribers))
+        if subject in self._pending:
+            self.coalesced[subject] += len(subscribers)
+            if monitor is not None:
+                monitor.coalesced(self, subject, len(subscribers))
+        else:
+            window = self._coalescing[subject]  # type: ignore
+            loop = asyncio.get_event_loop()
+            if window:
+                loop.call_later(window, self.flush, subject)
+            else:
+                loop.call_soon(self.flush, subject)
+        self._pending[subject] = body
+
+    def flush(self, subject: str) -> None:
+        body = self._pending.pop(subject)
+        for subscriber in (self._subscribers or {}).get(subject, []):
+            try:
+                if monitor is not None:
+                    monitor.deliver(self, subject, subscriber, body, None)
+                else:
+                    subscriber(body)
+            except Exception as err:
+                logger.error(f'{subscriber} failed handling `{subject}`', exc_info=err)
+
+
+class AsyncSubscriber:
+    # Runs a coroutine subscriber in a task of its own, so one that waits (on a database, a network peer) holds up
+    # neither the loop nor the other subscribers. Bodies wait in a bounded queue; when it is full, `overflow` decides
+    # whether the oldest or the newest is dropped. A subscriber falling behind (its backlog reaching `slow_depth` of
+    # the queue, a body waiting more than `max_lag` seconds, or a body taking longer than that to handle) is reported
+    # once, as a 'slow-subscriber' event on the publisher, until it catches up.
+    queue: collections.deque[tuple[float, Any]]
+    task: Optional[asyncio.Task] = None
+    watchdog: Optional[asyncio.TimerHandle] = None
+    delivered: int = 0
+    dropped: int = 0
+    slow: bool = False
+
+    def __init__(
+        self,
+        publisher: Publisher,
+        subject: str,
+        callback: Callable[[Any], Awaitable[Any]],
+        maxsize: int = ASYNC_QUEUE_SIZE,
+        overflow: str = DROP_OLDEST,
+        max_lag: float = ASYNC_MAX_LAG,
+        slow_depth: float = ASYNC_SLOW_DEPTH,
+    ) -> None:
+        if overflow not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f'unknown overflow policy `{overflow}`')
+        self.publisher = publisher
+        self.subject = subject
+        self.callback = callback
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.max_lag = max_lag
+        self.max_depth = max(1, int(maxsize * slow_depth))
+        self.queue = collections.deque()
+        self.ready = asyncio.Event()
+
+    def __call__(self, body: Any) -> None:
+        loop = asyncio.get_event_loop()
+        if self.task is None:
+            self.task = loop.create_task(self.run())
+        if len(self.queue) >= self.maxsize:
+            self.dropped += 1
+            if self.overflow == DROP_NEWEST:
+                return
+            self.queue.popleft()
+        now = loop.time()
+        self.queue.append((now, body))
+        self.ready.set()
+        if len(self.queue) >= self.max_depth:
+            self.report_slow('depth')
+        elif now - self.queue[0][0] > self.max_lag:
+            self.report_slow('lag')
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        queue = self.queue
+        while True:
+            if not queue:
+                self.ready.clear()
+                await self.ready.wait()
+            enqueued, body = queue.popleft()
+            if loop.time() - enqueued > self.max_lag:
+                self.report_slow('lag')
+            elif self.slow and len(queue) < self.max_depth // 2:
+                self.slow = False
+                logger.info(f'{self} has caught up')
+            # a callback that never returns is reported all the same, though nothing more is published.
+            self.watchdog = watchdog = loop.call_later(self.max_lag, self.report_slow, 'stalled')
+            try:
+                await self.callback(body)
+            except Exception as err:
+                logger.error(f'{self} failed', exc_info=err)
+            finally:
+                watchdog.cancel()
+                self.watchdog = None
+            self.delivered += 1
+
+    def report_slow(self, reason: str) -> None:
+        if self.slow:
+            return
+        self.slow = True
+        stats = self.stats()
+        logger.warning(f'{self} is falling behind ({reason}): {stats}')
+        self.publisher.publish('slow-subscriber', stats)
+
+    def stats(self) -> dict[str, Any]:
+        lag = asyncio.get_event_loop().time() - self.queue[0][0] if self.queue else 0.0
+        return {
+            'subject': self.subject,
+            'subscriber': getattr(self.callback, '__qualname__', repr(self.callback)),
+            'depth': len(self.queue),
+            'lag': lag,
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+        }
+
+    def stop(self) -> None:
+        if self.watchdog:
+            self.watchdog.cancel()
+            self.watchdog = None
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        self.queue.clear()
+
+    def __str__(self) -> str:
+        return f'<AsyncSubscriber {getattr(self.callback, "__qualname__", self.callback)} on `{self.subject}`>'
+
 
 class JSONWatcher(Publisher):
     def jsonify(self, text: str) -> None:
@@ -86,17 +313,50 @@ class PeriodicTask():
 
 
 class RemoteURLRefresher(PeriodicTask, Publisher):
-    def __init__(self, url: str, period: int = 60):
+    # Polls a JSON document. The connection is kept alive between polls, and the document is fetched conditionally
+    # (ETag/Last-Modified), so an unchanged document costs a 304 and is not published again. Servers that do not
+    # support conditional requests are handled by comparing a hash of the content instead. Either way, the document
+    # last accepted is published as 'unchanged', for subscribers whose view of it depends on when it was fetched.
+    session: requests.Session
+    data: Optional[Any] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    digest: Optional[str] = None
+    unchanged: int = 0
+
+    def __init__(self, url: str, period: int = 60, timeout: Union[float, Sequence[float]] = HTTP_TIMEOUT):
         PeriodicTask.__init__(self, period)
         Publisher.__init__(self)
         self.url = url
+        self.timeout = tuple(timeout) if isinstance(timeout, Sequence) else timeout
+        self.session = requests.Session()
+
+    def fetch(self) -> requests.Response:
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return self.session.get(self.url, headers=headers, timeout=self.timeout)
 
     async def execute(self) -> None:
         data = {}
         try:
-            response = await asyncio.to_thread(requests.get, self.url)
-        except requests.exceptions.ReadTimeout as e:
-            logger.warning(f'suppressing timeout on {self.url}.', exc_info=e)
+            response = await asyncio.to_thread(self.fetch)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f'suppressing request error on {self.url}.', exc_info=e)
+            return
+        if response.status_code == 304:
+            logger.debug(f'{self.url} not modified')
+            self.publish_unchanged()
+            return
+        if not response.ok:
+            logger.warning(f'update for {self.url} failed ({response.status_code}). ignoring...')
+            return
+        digest = hashlib.sha256(response.content).hexdigest()
+        if digest == self.digest:
+            logger.debug(f'{self.url} unchanged')
+            self.publish_unchanged()
             return
         try:
             txt = response.text
@@ -104,64 +364,206 @@ class RemoteURLRefresher(PeriodicTask, Publisher):
         except (json.JSONDecodeError, requests.JSONDecodeError):
             logger.warning(f'update for {self.url} failed. ignoring...')
             return
+        # only remember validators for content that was accepted.
+        self.digest = digest
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+        self.data = data
         self.publish('response', data)
 
+    def publish_unchanged(self) -> None:
+        self.unchanged += 1
+        if self.data is not None:
+            self.publish('unchanged', self.data)
+
     def __str__(self) -> str:
         return f"<RemoteURLRefresher: `{self.url}` @ {self.period}>"
 
 
-class FileRefresher(PeriodicTask, Publisher):
-    def __init__(self, path: Union[pathlib.Path, str], period: int = 60):
-        PeriodicTask.__init__(self, period)
-        Publisher.__init__(self)
-        self.path = pathlib.Path(path)
+class FileWatcher(Publisher):
+    # Publishes 'changed', with the new content, whenever a file's content changes (and once at the start). Changes
+    # are noticed through inotify where it is available, and otherwise by polling; either way they are confirmed by
+    # the file's modification time and size, then by a hash of its content, so touching or rewriting a file
+    # identically publishes nothing. `backstop` seconds after the last check, the file is checked regardless.
+    signature: Optional[tuple[int, int]] = None
+    digest: Optional[str] = None
+    missing: bool = False
+    inotify: Optional[hfdl_observer.watch.Inotify] = None
+    pending: Optional[asyncio.Handle] = None
+
+    def __init__(
+        self, path: Union[str, pathlib.Path], poll_interval: float = FILE_POLL_INTERVAL, backstop: float = 3600
+    ) -> None:
+        super().__init__()
+        self.path = pathlib.Path(path).absolute()
+        self.poll_interval = poll_interval
+        self.backstop = backstop
 
-    async def execute(self) -> None:
+    def check(self) -> Optional[bytes]:
+        # the new content, if it has changed.
         try:
-            text = self.path.read_text()
+            stat = self.path.stat()
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if signature == self.signature:
+                return None
+            content = self.path.read_bytes()
         except IOError as e:
-            logger.warning(f'suppressing file read error at {self.path}.', exc_info=e)
-        else:
-            self.publish('text', text)
+            if not self.missing:  # reported once, not on every check until it is back.
+                self.missing = True
+                logger.warning(f'suppressing file read error at {self.path}.', exc_info=e)
+            return None
+        if self.missing:
+            self.missing = False
+            logger.info(f'{self.path} is readable again')
+        self.signature = signature
+        digest = hashlib.sha256(content).hexdigest()
+        if digest == self.digest:
+            return None
+        self.digest = digest
+        return content
+
+    def refresh(self) -> None:
+        self.pending = None
+        content = self.check()
+        if content is not None:
+            logger.info(f'{self.path} changed')
+            self.publish('changed', content)
+
+    def on_events(self) -> None:
+        if self.inotify and self.path.name in self.inotify.read_names() and self.pending is None:
+            self.pending = asyncio.get_running_loop().call_later(FILE_SETTLE_TIME, self.refresh)
+
+    def watch(self) -> float:
+        # starts watching, and returns how long to wait between checks.
+        try:
+            self.inotify = hfdl_observer.watch.Inotify(self.path.parent)
+        except OSError as e:
+            logger.info(f'polling {self.path} for changes every {self.poll_interval}s ({e})')
+            return self.poll_interval
+        asyncio.get_running_loop().add_reader(self.inotify.fd, self.on_events)
+        return self.backstop
+
+    async def run(self) -> None:
+        interval = self.watch()
+        try:
+            self.refresh()
+            while True:
+                await asyncio.sleep(interval)
+                self.refresh()
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        if self.pending is not None:
+            self.pending.cancel()
+            self.pending = None
+        if self.inotify:
+            try:
+                asyncio.get_running_loop().remove_reader(self.inotify.fd)
+            except RuntimeError:
+                pass
+            self.inotify.close()
+            self.inotify = None
 
     def __str__(self) -> str:
-        return f"<FileRefresher: `{self.path}` @ {self.period}>"
+        return f'<FileWatcher: `{self.path}`>'
+
+
+class FileRefresher(Publisher):
+    # Publishes 'text' when the file changes (see `FileWatcher`); `backstop` is how long it may go unchecked.
+    def __init__(self, path: Union[pathlib.Path, str], backstop: float = 3600):
+        super().__init__()
+        self.path = pathlib.Path(path)
+        self.watcher = FileWatcher(self.path, backstop=backstop)
+        self.watcher.subscribe('changed', self.on_changed)
+
+    def on_changed(self, content: bytes) -> None:
+        self.publish('text', content.decode())
+
+    async def run(self) -> None:
+        logger.info(f'{self} watching')
+        await self.watcher.run()
+
+    def __str__(self) -> str:
+        return f"<FileRefresher: `{self.path}`>"
 
 
 class JSONFileRefresher(FileRefresher, JSONWatcher):
-    def __init__(self, path: Union[pathlib.Path, str], period: int = 60):
-        JSONWatcher.__init__(self)
-        FileRefresher.__init__(self, path, period)
+    def __init__(self, path: Union[pathlib.Path, str], backstop: float = 3600):
+        FileRefresher.__init__(self, path, backstop)
         self.subscribe('text', self.jsonify)
 
     def __str__(self) -> str:
-        return f"<JSONFileRefresher: `{self.path}` @ {self.period}>"
+        return f"<JSONFileRefresher: `{self.path}`>"
 
 
 class StreamWatcher(RoutineTask, Publisher):
+    # Reads a stream in large chunks, splitting them into lines in bulk, and publishes each chunk's lines together
+    # as 'lines' (and, for any subscribers to it, one by one as 'line'). The loop is given up every
+    # `yield_interval` seconds, rather than after every line, so a chatty stream neither starves the loop nor pays
+    # for a trip around it per line.
     debug_logger: Optional[logging.Logger]
 
-    def __init__(self, stream: AsyncGenerator, debug_logger: Optional[logging.Logger] = None):
+    def __init__(
+        self,
+        stream: Union[asyncio.StreamReader, AsyncGenerator],
+        debug_logger: Optional[logging.Logger] = None,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+        yield_interval: float = STREAM_YIELD_INTERVAL,
+    ):
         RoutineTask.__init__(self)
         Publisher.__init__(self)
         self.stream = stream
         self.debug_logger = debug_logger
+        self.chunk_size = chunk_size
+        self.yield_interval = yield_interval
+
+    async def batches(self) -> AsyncGenerator[list[bytes], None]:
+        # complete lines, as many at a time as have arrived.
+        if isinstance(self.stream, asyncio.StreamReader):
+            partial = b''
+            while chunk := await self.stream.read(self.chunk_size):
+                lines = (partial + chunk).split(b'\n')
+                partial = lines.pop()
+                if lines:
+                    yield lines
+            if partial:
+                yield [partial]
+        else:
+            # anything else is iterated for lines, one at a time, with or without their line endings.
+            async for line in self.stream:
+                yield [line]
+
+    def publish_lines(self, lines: list[bytes]) -> None:
+        decoded = [line.decode('utf8', errors='replace').rstrip() for line in lines]
+        if self.debug_logger:
+            for line in decoded:
+                self.debug_logger.info(line)
+        self.publish('lines', decoded)
+        if self._subscribers.get('line'):
+            for line in decoded:
+                self.publish('line', line)
 
     async def run(self) -> None:
         logger.info(f'watching {self.stream}')
-        async for data in self.stream:
-            line = data.decode('utf8').rstrip()
-            if self.debug_logger:
-                self.debug_logger.info(line)
-            self.publish('line', line)
+        loop = asyncio.get_running_loop()
+        yield_at = loop.time() + self.yield_interval
+        async for lines in self.batches():
+            self.publish_lines(lines)
             if not self.enabled:
                 break
-            await asyncio.sleep(0)
+            if loop.time() >= yield_at:
+                await asyncio.sleep(0)
+                yield_at = loop.time() + self.yield_interval
         logger.info(f'finished watching {self.stream}')
 
 
 class JSONStreamWatcher(StreamWatcher, JSONWatcher):
-    def __init__(self, stream: AsyncGenerator):
+    def __init__(self, stream: Union[asyncio.StreamReader, AsyncGenerator]):
         JSONWatcher.__init__(self)
         StreamWatcher.__init__(self, stream)
-        self.subscribe('line', self.jsonify)
+        self.subscribe('lines', self.jsonify_lines)
+
+    def jsonify_lines(self, lines: list[str]) -> None:
+        for line in lines:
+            self.jsonify(line)
@@ -0,0 +1,111 @@
+# hfdl_observer/codec.py
+# copyright 2024 Kuupa Ork <kuupaork+github@hfdl.observer>
+# see LICENSE (or https://github.com/hfdl-observer/hfdlobserver888/blob/main/LICENSE) for terms of use.
+# TL;DR: BSD 3-clause
+#
+
+import json
+import logging
+
+from typing import Any, Callable, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None  # type: ignore
+
+
+logger = logging.getLogger(__name__)
+
+
+JSONDecoder = Callable[[Union[str, bytes]], Any]
+
+# every backend raises a subclass of ValueError on bad input, except msgspec.
+DECODE_ERRORS: tuple[type[Exception], ...] = (ValueError,) + ((msgspec.DecodeError,) if msgspec else ())
+
+
+if msgspec is not None:
+    # A typed schema for the dumphfdl envelope. Only the fields the observer reads are described; anything else in
+    # the `hfdl` object is skipped by the decoder rather than materialized.
+    class Timestamp(msgspec.Struct):
+        sec: int
+        usec: int = 0
+
+    class HFDLFrame(msgspec.Struct, omit_defaults=True):
+        t: Timestamp
+        freq: int
+        sig_level: float
+        noise_level: float
+        app: Optional[dict[str, Any]] = None
+        station: Optional[str] = None
+        bit_rate: Optional[int] = None
+        freq_skew: Optional[float] = None
+        slot: Optional[Any] = None
+        spdu: Optional[dict[str, Any]] = None
+        lpdu: Optional[dict[str, Any]] = None
+
+    class Envelope(msgspec.Struct):
+        hfdl: HFDLFrame
+
+
+def stdlib_decoder() -> Optional[JSONDecoder]:
+    return json.loads
+
+
+def orjson_decoder() -> Optional[JSONDecoder]:
+    if orjson is None:
+        return None
+    return orjson.loads
+
+
+def msgspec_decoder() -> Optional[JSONDecoder]:
+    if msgspec is None:
+        return None
+    return msgspec.json.Decoder().decode
+
+
+def msgspec_typed_decoder() -> Optional[JSONDecoder]:
+    if msgspec is None:
+        return None
+    decoder = msgspec.json.Decoder(Envelope)
+    to_builtins = msgspec.to_builtins
+
+    def decode(text: Union[str, bytes]) -> Any:
+        # consumers expect plain mappings, so convert the validated frame back.
+        return {'hfdl': to_builtins(decoder.decode(text).hfdl)}
+    return decode
+
+
+DECODERS: dict[str, Callable[[], Optional[JSONDecoder]]] = {
+    'stdlib': stdlib_decoder,
+    'orjson': orjson_decoder,
+    'msgspec': msgspec_decoder,
+    'msgspec-typed': msgspec_typed_decoder,
+}
+AUTO_PREFERENCE = ['orjson', 'msgspec', 'stdlib']
+
+
+def available_decoders() -> list[str]:
+    return [name for name, factory in DECODERS.items() if factory() is not None]
+
+
+def get_decoder(name: str = 'auto') -> JSONDecoder:
+    candidates = AUTO_PREFERENCE if name == 'auto' else [name]
+    for candidate in candidates:
+        try:
+            decoder = DECODERS[candidate]()
+        except KeyError:
+            logger.warning(f'unknown JSON decoder `{candidate}`')
+            continue
+        if decoder is not None:
+            logger.debug(f'using {candidate} JSON decoder')
+            return decoder
+        if name != 'auto':
+            logger.warning(f'JSON decoder `{candidate}` is not installed')
+    logger.info('falling back to stdlib JSON decoder')
+    return json.loads
@@ -13,6 +13,7 @@ class ListenerConfig:
     proto: str = 'udp'
     address: str = '127.0.0.1'
     port: int = 5542
+    path: Optional[str] = None
 
 
 class Allocation:
@@ -47,6 +48,9 @@ class Allocation:
     def frequencies(self) -> list[int]:
         return sorted(self._frequencies)
 
+    def __contains__(self, frequency: int) -> bool:
+        return frequency in self._frequencies
+
     def maybe_add(self, frequency: int) -> bool:
         peephole_width = self.allowed_width - hfdl_observer.hfdl.HFDL_CHANNEL_WIDTH
         if not self._frequencies or (
@@ -69,3 +73,52 @@ class Parameters:
 
     def allocation(self, initial_frequencies: list[int]) -> Allocation:
         return Allocation(self.max_sample_rate, initial_frequencies)
+
+
+class FrequencyDelta:
+    # What changed between two sets of active station frequencies: the frequencies added and removed per station,
+    # the stations whose stratum changed (old, new), and the stations whose system table (assigned) frequencies
+    # changed. `frequencies` is the new active set in full. False when nothing changed.
+    added: dict[int, list[int]]
+    removed: dict[int, list[int]]
+    strata: dict[int, tuple[Optional[int], Optional[int]]]
+    systable: list[int]
+    frequencies: dict[int, list[int]]
+
+    def __init__(
+        self,
+        previous: dict[int, list[int]],
+        current: dict[int, list[int]],
+        previous_strata: Optional[dict[int, int]] = None,
+        current_strata: Optional[dict[int, int]] = None,
+        previous_systable: Optional[dict[int, list[int]]] = None,
+        current_systable: Optional[dict[int, list[int]]] = None,
+    ) -> None:
+        self.frequencies = current
+        self.added = {}
+        self.removed = {}
+        for sid in previous.keys() | current.keys():
+            before = set(previous.get(sid, []))
+            after = set(current.get(sid, []))
+            if after - before:
+                self.added[sid] = sorted(after - before)
+            if before - after:
+                self.removed[sid] = sorted(before - after)
+        self.strata = {}
+        previous_strata = previous_strata or {}
+        current_strata = current_strata or {}
+        for sid in previous_strata.keys() | current_strata.keys():
+            if previous_strata.get(sid) != current_strata.get(sid):
+                self.strata[sid] = (previous_strata.get(sid), current_strata.get(sid))
+        previous_systable = previous_systable or {}
+        current_systable = current_systable or {}
+        self.systable = sorted(
+            sid for sid in previous_systable.keys() | current_systable.keys()
+            if set(previous_systable.get(sid, [])) != set(current_systable.get(sid, []))
+        )
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.strata or self.systable)
+
+    def __str__(self) -> str:
+        return f'<FrequencyDelta +{self.added} -{self.removed} strata {self.strata} systable {self.systable}>'
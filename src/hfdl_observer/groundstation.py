@@ -6,10 +6,9 @@
 
 import collections
 import datetime
+import heapq
 import itertools
-import json
 import logging
-import re
 
 from collections.abc import Iterable
 from enum import Enum
@@ -17,6 +16,7 @@ from typing import Any, Iterator, Optional, Sequence, Union
 
 import hfdl_observer.bus
 import hfdl_observer.hfdl
+import hfdl_observer.libconfig
 
 
 logger = logging.getLogger(__name__)
@@ -25,6 +25,10 @@ GS_EXPIRY = 3600
 SQUITTER_FRAME_TIME = 32 * 6
 
 
+def utcnow() -> float:
+    return datetime.datetime.now(datetime.timezone.utc).timestamp()
+
+
 class Strata(Enum):
     SYSTABLE = 0
     CACHE = 1
@@ -39,11 +43,15 @@ class GroundStationFrequency:
         self._valid_at = valid_at or 0
         self.lifetime = lifetime
         self.active = self._valid_at > 0
+        # `valid_at` never changes (see its setter), so neither does this.
+        self.expires_at = self._valid_at + lifetime
+
+    def valid(self, now: float) -> bool:
+        return self.expires_at >= now
 
     @property
     def is_valid(self) -> bool:
-        now = datetime.datetime.now(datetime.timezone.utc).timestamp()
-        return self.valid_at + self.lifetime >= now
+        return self.expires_at >= utcnow()
 
     @property
     def is_active(self) -> bool:
@@ -72,6 +80,7 @@ class GroundStationFrequency:
 
 
 class GroundStation:
+    # Frequencies are kept in a min-heap on when they expire, so pruning them only looks at the expired ones.
     last_updated: int = 0
     update_source: Optional[str] = None
     stratum: Strata = Strata.CACHE  # slightly smelly
@@ -81,11 +90,15 @@ class GroundStation:
     default_lifetime: int = 0
     longitude: Optional[float] = None
     latitude: Optional[float] = None
+    _expiries: list[tuple[float, int]]
+    # when the table holding this station has it queued to be checked for expiry (see `GroundStationTable`).
+    scheduled: float = 0
 
     def __init__(self, station_id: int, name: Optional[str] = None, default_lifetime: int = GS_EXPIRY):
         self.id = station_id
         self.name = None
         self._frequencies = {}
+        self._expiries = []
         self.default_lifetime = default_lifetime
 
     def frequencies(self) -> Iterator[GroundStationFrequency]:
@@ -103,6 +116,8 @@ class GroundStation:
             frequency = GroundStationFrequency.build(f, stamp, self.default_lifetime)
             stored = self._frequencies.setdefault(frequency.khz, frequency)
             stored.valid_at = max(stored.valid_at, frequency.valid_at)
+            if stored is frequency:
+                heapq.heappush(self._expiries, (frequency.expires_at, frequency.khz))
 
     def set_frequencies(
         self, frequencies: Sequence[Union[int, GroundStationFrequency]], stamp: Optional[int] = None
@@ -114,26 +129,47 @@ class GroundStation:
             for f in frequencies or []:
                 fs.append(GroundStationFrequency.build(f, stamp, self.default_lifetime))
             self._frequencies = {freq.khz: freq for freq in fs}
+            self._expiries = [(freq.expires_at, khz) for khz, freq in self._frequencies.items()]
+            heapq.heapify(self._expiries)
 
-    def prune_expired_frequencies(self) -> None:
-        for key, value in list(self._frequencies.items()):
-            if not value.is_valid:
-                del self._frequencies[key]
+    @property
+    def next_expiry(self) -> float:
+        # when the next frequency expires; a station without frequencies is already expired.
+        return self._expiries[0][0] if self._expiries else 0
+
+    def prune_expired_frequencies(self, now: Optional[float] = None) -> list[int]:
+        # removes, and returns, the frequencies that have expired.
+        if now is None:
+            now = utcnow()
+        expired = []
+        expiries = self._expiries
+        while expiries and expiries[0][0] < now:
+            _, khz = heapq.heappop(expiries)
+            frequency = self._frequencies.get(khz)
+            if frequency is not None and not frequency.valid(now):
+                del self._frequencies[khz]
+                expired.append(khz)
+        return expired
 
     def __str__(self) -> str:
         return f"<GroundStation #{self.id} {self.name}>"
 
+    def has_active_frequencies(self, now: float) -> bool:
+        return any(frequency.active and frequency.valid(now) for frequency in self._frequencies.values())
+
     @property
     def any_active_frequencies(self) -> bool:
-        return any(frequency.is_active for frequency in self._frequencies.values())
+        return self.has_active_frequencies(utcnow())
 
     @property
     def active_frequencies(self) -> list[GroundStationFrequency]:
-        return [frequency for frequency in self._frequencies.values() if frequency.is_active]
+        now = utcnow()
+        return [frequency for frequency in self._frequencies.values() if frequency.active and frequency.valid(now)]
 
     @property
     def valid_frequencies(self) -> list[GroundStationFrequency]:
-        return [frequency for frequency in self._frequencies.values() if frequency.is_valid]
+        now = utcnow()
+        return [frequency for frequency in self._frequencies.values() if frequency.valid(now)]
 
     @property
     def last_pseudoframe(self) -> int:
@@ -141,30 +177,90 @@ class GroundStation:
 
 
 class GroundStationTable(hfdl_observer.bus.Publisher):
+    # Stations are queued in a min-heap on when their next frequency expires, so pruning costs O(expired) rather
+    # than a scan of every frequency of every station. Entries are invalidated lazily: a station is queued again
+    # only if a change brings its expiry forward, and entries that no longer match the station's `scheduled` time
+    # are skipped. What expires is published as 'expired'. The ids of the stations changed by an update (touched, or
+    # with something expired) are published as 'changes', so listeners need only look at those.
     updates = 0
+    # counts the changes to the stations held, by touch or expiry.
+    revision = 0
     LIFETIME = 3 * GS_EXPIRY
     stations_by_id: dict[int, GroundStation]
     stations_by_name: dict[str, GroundStation]
+    expiries: list[tuple[float, int]]
+    touched: set[int]
 
     def __init__(self) -> None:
         super().__init__()
         self.stations_by_id = {}
         self.stations_by_name = {}
-
-    def update_lookups(self) -> None:
-        self.stations_by_name = {gs.name: gs for gs in self.stations_by_id.values() if gs.name}
-
-    def prune_expired(self) -> None:
-        for station in list(self.stations_by_id.values()):
-            station.prune_expired_frequencies()
-            if not station.any_active_frequencies and station.id in self.stations_by_id:
+        self.expiries = []
+        self.touched = set()
+
+    def update_lookups(self, changes: Optional[Iterable[int]] = None) -> None:
+        if changes is None:
+            self.stations_by_name = {gs.name: gs for gs in self.stations_by_id.values() if gs.name}
+            return
+        for sid in changes:
+            for name in [name for name, gs in self.stations_by_name.items() if gs.id == sid]:
+                del self.stations_by_name[name]
+            station = self.stations_by_id.get(sid)
+            if station is not None and station.name:
+                self.stations_by_name[station.name] = station
+
+    def touch(self, station: GroundStation) -> None:
+        # marks a station as changed by the update in progress.
+        self.touched.add(station.id)
+        self.revision += 1
+
+    def schedule(self, station: GroundStation) -> None:
+        expiry = station.next_expiry
+        if expiry < station.scheduled:
+            station.scheduled = expiry
+            heapq.heappush(self.expiries, (expiry, station.id))
+
+    def prune_expired(self, now: Optional[float] = None) -> set[int]:
+        # returns the ids of the stations touched or expired since the last call.
+        if now is None:
+            now = utcnow()
+        for sid in self.touched:
+            station = self.stations_by_id.get(sid)
+            if station is not None:
+                self.schedule(station)
+        changes = self.touched
+        self.touched = set()
+        expired_stations = []
+        expired_frequencies = {}
+        expiries = self.expiries
+        while expiries and expiries[0][0] < now:
+            when, sid = heapq.heappop(expiries)
+            station = self.stations_by_id.get(sid)
+            if station is None or station.scheduled != when:
+                continue
+            khzs = station.prune_expired_frequencies(now)
+            if khzs:
+                expired_frequencies[sid] = khzs
+            if station.has_active_frequencies(now):
+                station.scheduled = station.next_expiry
+                heapq.heappush(expiries, (station.scheduled, sid))
+            else:
                 logger.debug(f'{self} pruning {station}')
-                del self.stations_by_id[station.id]
+                del self.stations_by_id[sid]
+                expired_stations.append(sid)
+        if expired_stations or expired_frequencies:
+            self.publish('expired', {'stations': expired_stations, 'frequencies': expired_frequencies})
+            changes.update(expired_stations)
+            changes.update(expired_frequencies)
+            self.revision += 1
+        return changes
 
     def update(self, extra: Any) -> None:
         self.updates += 1
-        self.prune_expired()
-        self.update_lookups()
+        changes = self.prune_expired(utcnow())
+        self.update_lookups(changes)
+        if changes:
+            self.publish('changes', changes)
         self.publish('update', self)
 
     def get(self, key: Union[int, str], autocreate: bool = False) -> GroundStation:
@@ -173,20 +269,25 @@ class GroundStationTable(hfdl_observer.bus.Publisher):
         except ValueError:
             return self.stations_by_name[str(key)]
         try:
-            return self.stations_by_id[ik]
+            station = self.stations_by_id[ik]
         except KeyError:
             if autocreate:
                 station = GroundStation(ik, default_lifetime=self.LIFETIME)
                 try:
-                    loc = hfdl_observer.hfdl.STATIONS[ik]
+                    loc = hfdl_observer.hfdl.STATIONS.station(ik)
                 except KeyError:
                     pass
                 else:
                     station.longitude = loc['longitude']
                     station.latitude = loc['latitude']
                 self.stations_by_id[ik] = station
+                # checked at the next update.
+                station.scheduled = 0
+                heapq.heappush(self.expiries, (0, ik))
+                self.touch(station)
                 return station
             raise
+        return station
 
     def __getitem__(self, key: Union[int, str]) -> GroundStation:
         return self.get(key)
@@ -221,13 +322,23 @@ class GroundStationTable(hfdl_observer.bus.Publisher):
 
 
 class GroundStationStatus(hfdl_observer.bus.Publisher):
+    # The strata of each station, and the station ids and names, are kept up to date from the 'changes' published
+    # by the tables, so a squitter only costs the stations it changed.
     _tables: list[GroundStationTable]
     cached_station_strata: dict[int, dict[Strata, list[GroundStation]]]
+    names_by_id: dict[int, set[str]]
+    name_counts: collections.Counter[str]
+    _station_ids: Optional[list[int]] = None
+    _station_names: Optional[list[str]] = None
 
     def __init__(self) -> None:
         super().__init__()
         self._tables = []
         self.cached_station_strata = {}
+        self.names_by_id = {}
+        self.name_counts = collections.Counter()
+        # a burst of squitters updates the tables many times over; one save needs scheduling per burst.
+        self.coalesce('update')
 
     @property
     def tables(self) -> Iterator[GroundStationTable]:
@@ -235,17 +346,40 @@ class GroundStationStatus(hfdl_observer.bus.Publisher):
 
     def add_table(self, table: GroundStationTable) -> None:
         self._tables.append(table)
+        table.subscribe('changes', self.on_table_changes)
         table.subscribe('update', self.on_table_updated)
+        self.on_table_changes(table.stations_by_id.keys())
+
+    def on_table_changes(self, changes: Iterable[int]) -> None:
+        for sid in changes:
+            strata = self.station_strata(sid)
+            if (sid in self.cached_station_strata) != bool(strata):
+                self._station_ids = None
+            if strata:
+                self.cached_station_strata[sid] = strata
+            else:
+                self.cached_station_strata.pop(sid, None)
+            names = {station.name for stations in strata.values() for station in stations if station.name}
+            previous = self.names_by_id.pop(sid, set())
+            if names:
+                self.names_by_id[sid] = names
+            if names != previous:
+                self.name_counts.update(names - previous)
+                self.name_counts.subtract(previous - names)
+                for name in previous - names:
+                    if self.name_counts[name] <= 0:
+                        del self.name_counts[name]
+                self._station_names = None
 
     def on_table_updated(self, table: GroundStationTable) -> None:
         self.publish('update', self)
-        self.populate_strata()
 
     def valid_frequencies(self, for_station: GroundStation) -> list[int]:
         # valid frequencies gives you the list of valids from all available tables.
         found = set()
+        now = utcnow()
         for gsf in itertools.chain(*(lookup.valid_frequencies(for_station.id) for lookup in self.tables)):
-            if gsf.is_valid:
+            if gsf.valid(now):
                 found.add(gsf.khz)
         return sorted(found)
 
@@ -262,19 +396,15 @@ class GroundStationStatus(hfdl_observer.bus.Publisher):
 
     @property
     def station_names(self) -> list[str]:
-        found = set()
-        for lookup in self.tables:
-            for station in lookup.stations_by_name.keys():
-                found.add(station)
-        return sorted(found)
+        if self._station_names is None:
+            self._station_names = sorted(self.name_counts)
+        return self._station_names
 
     @property
     def station_ids(self) -> list[int]:
-        found = set()
-        for lookup in self.tables:
-            for station in lookup.stations_by_id.keys():
-                found.add(station)
-        return sorted(found)
+        if self._station_ids is None:
+            self._station_ids = sorted(self.cached_station_strata)
+        return self._station_ids
 
     def get(self, station_key: Union[int, str]) -> GroundStation:
         sid = int(station_key)
@@ -291,9 +421,11 @@ class GroundStationStatus(hfdl_observer.bus.Publisher):
         return self.get(key)
 
     def populate_strata(self) -> None:
-        for sid in self.station_ids:
-            ss = self.station_strata(sid)
-            self.cached_station_strata[sid] = ss
+        # rebuilds everything; normally kept up to date by `on_table_changes`.
+        sids = set(self.cached_station_strata)
+        for table in self.tables:
+            sids.update(table.stations_by_id.keys())
+        self.on_table_changes(sids)
 
     def station_strata(self, station_key: Union[int, str]) -> dict[Strata, list[GroundStation]]:
         strata = collections.defaultdict(list)
@@ -307,7 +439,24 @@ class GroundStationStatus(hfdl_observer.bus.Publisher):
         return strata
 
 
+def squitter_fingerprint(gs_status: list[dict]) -> int:
+    # only what the squitter tables use; far cheaper than hashing the whole structure.
+    return hash(tuple(
+        (gs['gs']['id'], gs['gs'].get('name'), *(sf.get('freq') for sf in gs['freqs'])) for gs in gs_status
+    ))
+
+
 class SquitterTable(GroundStationTable):
+    # A ground station repeats the same squitter on each of its frequencies, every 32 seconds. Each source's last
+    # squitter is remembered by a fingerprint of its content and pseudoframe; when it comes round again and the
+    # table has not changed since, it would change nothing, so it is not processed at all.
+    fingerprints: dict[int, tuple[int, int, int]]
+    fingerprint_hits: int = 0
+    fingerprint_misses: int = 0
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.fingerprints = {}
 
     def update(self, hfdl_packet: hfdl_observer.hfdl.HFDLPacketInfo) -> None:
         hfdl = hfdl_packet.packet
@@ -316,8 +465,16 @@ class SquitterTable(GroundStationTable):
         squitter = hfdl.get('spdu', {})
         if squitter:
             self.publish("event", ("squitter", hfdl_packet.station, last_updated))
-        for gs in squitter.get('gs_status', []):
-            src_id = hfdl_packet.ground_station['id']
+        gs_status = squitter.get('gs_status', [])
+        if not gs_status:
+            return
+        src_id = hfdl_packet.ground_station['id']
+        fingerprint = (last_updated // SQUITTER_FRAME_TIME, squitter_fingerprint(gs_status))
+        if self.fingerprints.get(src_id) == (*fingerprint, self.revision):
+            self.fingerprint_hits += 1
+            return
+        self.fingerprint_misses += 1
+        for gs in gs_status:
             sid = gs['gs']['id']
             stn_id = int(sid) if sid else None
             if not self.should_process(src_id, stn_id):
@@ -332,9 +489,11 @@ class SquitterTable(GroundStationTable):
                 station.set_frequencies(new_freqs)
                 logger.debug(f'squitter update for {station}')
                 station.stratum = Strata.SELF if stn_id == src_id else Strata.SQUITTER
+                self.touch(station)
                 any_updated = True
         if any_updated:
             super().update(None)
+        self.fingerprints[src_id] = (*fingerprint, self.revision)
 
     def should_process(self, src_id: int, station_id: Optional[int]) -> bool:
         return True
@@ -361,6 +520,7 @@ class UpdateTable(GroundStationTable):
                 station.name = gs['gs']['name']
                 station.stratum = Strata.PERFORMANCE
                 station.add_frequencies(freqs)
+                self.touch(station)
                 any_updated = True
                 logger.debug(f'performance update for {station}')
         if any_updated:
@@ -384,39 +544,40 @@ class AirframesStationTable(GroundStationTable):
                 station.update_source = gs.get('update_source', 'remote')
                 station.stratum = Strata(gs.get('stratum', Strata.CACHE))
                 station.set_frequencies(gs['frequencies']['active'])
+                self.touch(station)
                 # logger.debug(f'airframes update for {station}')
         super().update(None)
 
+    def refresh(self, airframes: dict) -> None:
+        # The document is unchanged since the last update. Stations stamped relative to the time of fetching
+        # (negative `last_updated`) are current as of now, so they are updated again; the others have nothing new.
+        relative = [gs for gs in airframes.get('ground_stations', []) if gs.get('last_updated', 0) < 0]
+        if relative:
+            self.update({'ground_stations': relative})
+
 
 class SystemTable(GroundStationTable):
     LIFETIME = 10 * 365 * 24 * 3600
 
     def update(self, station_table: str) -> None:
-        # station table is a custom "conf" format. Almost, but not quite, JSON.
-        # sed -e 's/(/[/g' -e s'/)/]/g' -e 's/=/:/g' -e 's/;/,/g' -e 's/^\s*\([a-z]\+\) /"\1"/' >> ~/gs.json
-        # does most of the conversion, but not quite.
-        # first the simple substitutions
-        for f, t in [('(', '['), (')', ']'), ('=', ':'), (';', ',')]:
-            station_table = station_table.replace(f, t)
-        # quote the keys...
-        lines = station_table.split('\n')
-        for ix, line in enumerate(lines):
-            lines[ix] = re.sub(r'^\s*([a-z]+) ', r'"\1"', line).strip()
-        # remove trailing commas
-        station_table = '{' + ''.join(lines).replace(',}', '}').replace(',]', ']').strip(',') + '}'
-        # in theory it is now JSON decodable.
-        data = json.loads(station_table)
+        # the dumphfdl system table, in libconfig format.
+        try:
+            data = hfdl_observer.libconfig.loads(station_table)
+        except hfdl_observer.libconfig.LibconfigError as e:
+            logger.warning(f'{self} ignoring unparseable system table', exc_info=e)
+            return
         hfdl_stations: dict[int, dict] = {}
         for gs in data['stations']:
             station = self.get(gs['id'], autocreate=True)
             station.name = gs['name']
             station.last_updated = int(datetime.datetime.now(datetime.timezone.utc).timestamp() - GS_EXPIRY)
             station.update_source = 'systable'
-            station.longitude = gs['lon']
-            station.latitude = gs['lat']
+            station.longitude = gs.get('lon')
+            station.latitude = gs.get('lat')
             station.stratum = Strata.SYSTABLE
             freqs = [int(f) for f in gs['frequencies']]
             station.set_frequencies(freqs)
+            self.touch(station)
             hfdl_stations.setdefault(gs['id'], {}).update({
                 'longitude': station.longitude,
                 'latitude': station.latitude,
@@ -438,34 +599,61 @@ class ObserverTable(GroundStationTable):
                 station.update_source = station.update_source
                 station.stratum = station.stratum
                 station.add_frequencies(gs.valid_frequencies)
+                self.touch(station)
         super().update(None)
 
 
+class RingCounter:
+    # Counts events over a sliding window in a fixed ring of time buckets, each `horizon / buckets` seconds wide:
+    # constant memory however many events there are, O(1) to add one and O(buckets) to count. Counts are accurate
+    # to within a bucket; events older than the window are not counted.
+    def __init__(self, horizon: int = GS_EXPIRY, buckets: int = 60) -> None:
+        self.width = horizon / buckets
+        # a window can straddle `buckets + 1` buckets.
+        self.counts = [0] * (buckets + 1)
+        self.epochs = [-1] * (buckets + 1)  # the bucket number each slot is counting.
+
+    def add(self, timestamp: float, count: int = 1) -> None:
+        epoch = int(timestamp // self.width)
+        slot = epoch % len(self.counts)
+        current = self.epochs[slot]
+        if epoch != current:
+            if epoch < current:  # older than the window the slot has moved on to.
+                return
+            self.epochs[slot] = epoch
+            self.counts[slot] = 0
+        self.counts[slot] += count
+
+    def count(self, since: float) -> int:
+        first = int(since // self.width)
+        return sum(count for count, epoch in zip(self.counts, self.epochs) if epoch >= first)
+
+
 class ActorStats:
-    events: dict[str, dict[str, Any]]
+    events: dict[str, dict[str, RingCounter]]
 
-    def __init__(self, horizon: int = GS_EXPIRY):
+    def __init__(self, horizon: int = GS_EXPIRY, buckets: int = 60):
         self.events = collections.defaultdict(dict)
         self.horizon = horizon
+        self.buckets = buckets
 
     def add_event(self, event: str, actor: str, timestamp: int) -> None:
-        self.events[event].setdefault(actor, []).append(timestamp)
+        actors = self.events[event]
+        try:
+            counter = actors[actor]
+        except KeyError:
+            counter = actors[actor] = RingCounter(self.horizon, self.buckets)
+        counter.add(timestamp)
 
     def counts(self, event: str) -> dict[str, int]:
-        cutoff = datetime.datetime.now(datetime.timezone.utc).timestamp() - self.horizon
-        results = {}
-        actor: str
-        hits: list[int]
-        for actor, hits in self.events[event].items():
-            results[actor] = sum(1 for hit in hits if hit >= cutoff)
-        return results
+        cutoff = utcnow() - self.horizon
+        return {actor: counter.count(cutoff) for actor, counter in self.events[event].items()}
 
     def prune(self, epoch: Optional[int] = None) -> None:
+        # the counters are bounded anyway; this forgets actors not heard from within the horizon.
         if epoch is None:
-            epoch = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+            epoch = int(utcnow())
         cutoff = epoch - self.horizon
         for event in self.events.values():
-            for actor in event:
-                current = event[actor]
-                pruned = [hit for hit in current if hit >= cutoff]
-                event[actor] = pruned
+            for actor in [actor for actor, counter in event.items() if not counter.count(cutoff)]:
+                del event[actor]
@@ -4,64 +4,181 @@
 # TL;DR: BSD 3-clause
 #
 
+import bisect
 import datetime
+import enum
 import logging
+import warnings
 
 from typing import Any, Optional, Union
 
 
 HFDL_CHANNEL_WIDTH: float = 2.4
+_UNSET: Any = object()
+# the header fields kept in a compact packet.
+COMPACT_FIELDS = ('t', 'freq', 'bit_rate', 'bitrate', 'sig_level', 'noise_level', 'freq_skew', 'slot', 'station')
 
 
 logger = logging.getLogger()
 
 
+class PacketType(enum.IntFlag):
+    NONE = 0
+    SQUITTER = enum.auto()
+    PERFORMANCE = enum.auto()  # carries `freq_data`
+    LOGON = enum.auto()
+    ACARS = enum.auto()
+    POSITION = enum.auto()
+    UPLINK = enum.auto()
+    DOWNLINK = enum.auto()
+    OTHER = enum.auto()  # none of the above; ensures every packet has at least one type.
+    ANY = SQUITTER | PERFORMANCE | LOGON | ACARS | POSITION | UPLINK | DOWNLINK | OTHER
+
+
 class HFDLPacketInfo:
+    # Packet views are created for every decoded frame, so they are slotted, and only the header fields every
+    # consumer uses are extracted up front. Everything else is derived on first access and cached.
+    __slots__ = (
+        'packet', 'timestamp', 'frequency', 'snr',
+        '_src', '_dst', '_ground_station', '_is_uplink', '_is_downlink', '_position', '_packet_types',
+    )
+
     packet: dict[str, Any]
     timestamp: int
     frequency: int
-    ground_station: dict[str, Any]
-    station: Optional[str]
-    bitrate: Optional[int]
-    skew: Optional[float]
-    frame_slot: Optional[int]
     snr: float
-    src: dict[str, Any]
-    dst: dict[str, Any]
 
-    def __init__(self, packet: dict[str, Any]):
-        # Not at all a full extraction of a packet.
+    def __init__(self, packet: dict[str, Any], packet_types: Optional[PacketType] = None):
         packet = packet.get('hfdl', packet)  # in case it's not unwrapped.
         self.packet = packet
         self.timestamp = packet['t']['sec']
         self.frequency = packet['freq'] // 1000
-        self.bitrate = packet.get('bitrate')
-        self.skew = packet.get('freq_skew')
-        self.frame_slot = packet.get('slot')
         self.snr = packet['sig_level'] - packet['noise_level']
-        app_data = packet.get('spdu', packet.get('lpdu', {}))
-        self.src = app_data.get('src', {})
-        self.dst = app_data.get('dst', {})
-        self.station = packet.get('station')
-        if self.is_downlink:
-            self.ground_station = self.dst
-        elif self.is_uplink:
-            self.ground_station = self.src
+        self._src = self._dst = self._ground_station = self._position = _UNSET
+        # packets classified elsewhere (eg. in a decode worker) can skip classification.
+        self._packet_types = _UNSET if packet_types is None else packet_types
+        self._is_uplink = self._is_downlink = False
+
+    def _extract_addresses(self) -> None:
+        app_data = self.packet.get('spdu', self.packet.get('lpdu', {}))
+        self._src = app_data.get('src', {})
+        self._dst = app_data.get('dst', {})
+        self._is_uplink = self._src.get('type') == 'Ground station'
+        self._is_downlink = self._dst.get('type') == 'Ground station'
+        if self._is_downlink:
+            self._ground_station = self._dst
+        elif self._is_uplink:
+            self._ground_station = self._src
         else:
-            self.ground_station = {}
+            self._ground_station = {}
+
+    @property
+    def src(self) -> dict[str, Any]:
+        if self._src is _UNSET:
+            self._extract_addresses()
+        return self._src  # type: ignore
+
+    @property
+    def dst(self) -> dict[str, Any]:
+        if self._dst is _UNSET:
+            self._extract_addresses()
+        return self._dst  # type: ignore
+
+    @property
+    def ground_station(self) -> dict[str, Any]:
+        if self._ground_station is _UNSET:
+            self._extract_addresses()
+        return self._ground_station  # type: ignore
+
+    @property
+    def station(self) -> Optional[str]:
+        return self.packet.get('station')
+
+    @property
+    def bitrate(self) -> Optional[int]:
+        return self.packet.get('bitrate')
+
+    @property
+    def skew(self) -> Optional[float]:
+        return self.packet.get('freq_skew')
+
+    @property
+    def frame_slot(self) -> Optional[int]:
+        return self.packet.get('slot')
 
     @property
     def is_uplink(self) -> bool:
-        return self.src.get('type') == 'Ground station'
+        if self._src is _UNSET:
+            self._extract_addresses()
+        return self._is_uplink
 
     @property
     def is_downlink(self) -> bool:
-        return self.dst.get('type') == 'Ground station'
+        if self._src is _UNSET:
+            self._extract_addresses()
+        return self._is_downlink
 
     @property
     def is_squitter(self) -> bool:
         return True if self.packet.get('spdu') else False
 
+    @property
+    def packet_types(self) -> PacketType:
+        if self._packet_types is _UNSET:
+            self._packet_types = self._classify()
+        return self._packet_types  # type: ignore
+
+    def _classify(self) -> PacketType:
+        # from the raw keys alone, so that classifying leaves the addresses and position to be derived lazily.
+        packet = self.packet
+        packet_types = PacketType.NONE
+        if packet.get('spdu'):
+            packet_types |= PacketType.SQUITTER
+        lpdu = packet.get('lpdu')
+        if lpdu:
+            if lpdu.get('type', {}).get('name', '').startswith(('Logon', 'Logoff')):
+                packet_types |= PacketType.LOGON
+            hfnpdu = lpdu.get('hfnpdu')
+            if hfnpdu:
+                if 'freq_data' in hfnpdu:
+                    packet_types |= PacketType.PERFORMANCE
+                if 'acars' in hfnpdu:
+                    packet_types |= PacketType.ACARS
+                report = self._position_report(hfnpdu)
+                if report and 'lat' in report and 'lon' in report:
+                    packet_types |= PacketType.POSITION
+        app_data = packet.get('spdu', lpdu or {})
+        if app_data.get('src', {}).get('type') == 'Ground station':
+            packet_types |= PacketType.UPLINK
+        if app_data.get('dst', {}).get('type') == 'Ground station':
+            packet_types |= PacketType.DOWNLINK
+        return packet_types or PacketType.OTHER
+
+    def compact(self) -> dict[str, Any]:
+        # A copy of the packet holding only what this view, and the observer's own consumers, read: the header, the
+        # addresses, squitter and performance station data, and the position report. ACARS content and the like
+        # are left out, so classify first; the packet types are not recomputed from a compact packet.
+        packet = self.packet
+        result = {k: packet[k] for k in COMPACT_FIELDS if k in packet}
+        spdu = packet.get('spdu')
+        if spdu:
+            result['spdu'] = compact_spdu = {k: spdu[k] for k in ('src', 'dst') if k in spdu}
+            if 'gs_status' in spdu:
+                compact_spdu['gs_status'] = [
+                    {k: gs[k] for k in ('gs', 'freqs') if k in gs} for gs in spdu['gs_status']
+                ]
+        lpdu = packet.get('lpdu')
+        if lpdu:
+            result['lpdu'] = compact_lpdu = {k: lpdu[k] for k in ('src', 'dst', 'type') if k in lpdu}
+            hfnpdu = lpdu.get('hfnpdu')
+            if hfnpdu:
+                compact_lpdu['hfnpdu'] = compact_hfnpdu = {}
+                if 'freq_data' in hfnpdu:
+                    compact_hfnpdu['freq_data'] = hfnpdu['freq_data']
+                if self.packet_types & PacketType.POSITION:
+                    compact_hfnpdu['pos'] = self._position_report(hfnpdu)
+        return result
+
     @property
     def when(self) -> datetime.datetime:
         return datetime.datetime.utcfromtimestamp(self.timestamp)
@@ -71,6 +188,20 @@ class HFDLPacketInfo:
 
     @property
     def position(self) -> Optional[tuple[str, str]]:
+        if self._position is _UNSET:
+            self._position = self._extract_position()
+        return self._position  # type: ignore
+
+    def _extract_position(self) -> Optional[tuple[str, str]]:
+        hfnpdu = self.packet.get('lpdu', {}).get('hfnpdu')
+        report = self._position_report(hfnpdu) if hfnpdu else None
+        try:
+            return (report['lat'], report['lon']) if report else None
+        except KeyError:
+            return None
+
+    @classmethod
+    def _position_report(cls, hfnpdu: dict[str, Any]) -> Optional[dict[str, Any]]:
         # position could be in several places...
         # all in "hfdl.lpdu.hfnpdu"
         # "pos"
@@ -87,23 +218,17 @@ class HFDLPacketInfo:
                 return get_path(node, cdr)
             return node
 
-        try:
-            hfnpdu = self.packet.get('lpdu', {}).get('hfnpdu')
-            if hfnpdu:
-                pos = hfnpdu.get('pos')
-                if pos:
-                    return (pos['lat'], pos['lon'])
-                for tag in get_path(hfnpdu, ['acars', 'arinc622', 'adsc', 'tags']) or []:
-                    pos = tag.get('basic_report')
-                    if pos:
-                        return (pos['lat'], pos['lon'])
-                for p in [self.cpdlc_pos, self.cpdlc_alt]:
-                    pos = get_path(hfnpdu, p)
-                    if pos:
-                        return (pos['lat'], pos['lon'])
-        except KeyError:
-            pass
-
+        pos = hfnpdu.get('pos')
+        if pos:
+            return pos  # type: ignore
+        for tag in get_path(hfnpdu, ['acars', 'arinc622', 'adsc', 'tags']) or []:
+            pos = tag.get('basic_report')
+            if pos:
+                return pos  # type: ignore
+        for p in [cls.cpdlc_pos, cls.cpdlc_alt]:
+            pos = get_path(hfnpdu, p)
+            if pos:
+                return pos  # type: ignore
         return None
 
     def __str__(self) -> str:
@@ -117,39 +242,81 @@ class HFDLPacketInfo:
             gs = self.ground_station.get('name', None)
             if gs is None:
                 gs_id = self.ground_station.get('id', -1)
-                gs = STATIONS.get(gs_id).get('name', 'n/a')
+                gs = STATIONS.station(gs_id, {}).get('name', 'n/a')
             gs = gs.split(',', 1)[0]
         else:
             gs = 'unknown'
         return f'<HFDL/{subtype} {station}@{self.timestamp} {self.frequency}kHz ({self.snr:.1f}dB) {direction} {gs}>'
 
 
+GET_DEPRECATED = 'StationLookup lookups by id or frequency are deprecated; use station() or stations_on()'
+
+
 class StationLookup:
+    # Indexes the system table by station id, and by frequency. Several stations may share a frequency, so
+    # `by_freq` maps each to a list; `freqs` is every frequency in order, for passband lookups by bisection. Any
+    # map of stations with `frequencies` can be indexed (the conductor indexes changed frequencies this way); the
+    # system table's index, `STATIONS`, is rebuilt on each system table update.
     by_id: dict[int, dict]
-    by_freq: dict[int, dict]
+    by_freq: dict[int, list[dict]]
+    freqs: list[int]
 
-    def update(self, systable: dict[int, Any]) -> None:
-        self.by_id = systable
+    def __init__(self) -> None:
+        self.by_id = {}
         self.by_freq = {}
+        self.freqs = []
+
+    def update(self, systable: dict[int, Any]) -> None:
+        by_freq: dict[int, list[dict]] = {}
         for sid, station in systable.items():
             for freq in station['frequencies']:
-                self.by_freq[freq] = station
+                by_freq.setdefault(int(freq), []).append(station)
+        self.by_id = systable
+        self.by_freq = by_freq
+        self.freqs = sorted(by_freq)
 
+    def station(self, sid: int, default: Any = _UNSET) -> Any:
+        try:
+            return self.by_id[int(sid)]
+        except (KeyError, TypeError, ValueError):
+            if default is _UNSET:
+                raise KeyError(f'no station {sid}')
+            return default
+
+    def stations_on(self, frequency: int) -> list[dict]:
+        return self.by_freq.get(int(frequency), [])
+
+    def within(self, low: int, high: int) -> list[tuple[int, dict]]:
+        # (frequency, station) for every station with a frequency in [low, high] kHz.
+        start = bisect.bisect_left(self.freqs, low)
+        end = bisect.bisect_right(self.freqs, high)
+        return [(freq, station) for freq in self.freqs[start:end] for station in self.by_freq[freq]]
+
+    def near(self, frequency: int, width: int) -> list[tuple[int, dict]]:
+        return self.within(frequency - width, frequency + width)
+
+    # Deprecated: ids and frequencies in one keyspace (ids are all below 2000), and a shared frequency gives only
+    # its first station. Use `station` and `stations_on`.
     def __getitem__(self, key: Union[str, int, float]) -> Any:
-        return self.get(key)
+        warnings.warn(GET_DEPRECATED, DeprecationWarning, 2)
+        return self._get(key)
 
     def get(self, key: Union[str, int, float], default: Optional[dict[int, Any]] = None) -> Any:
+        warnings.warn(GET_DEPRECATED, DeprecationWarning, 2)
+        return self._get(key, default)
+
+    def _get(self, key: Union[str, int, float], default: Optional[dict[int, Any]] = None) -> Any:
         try:
             k = int(key)
             if k < 2000:
                 return self.by_id[k]
-            return self.by_freq[k]
+            return self.by_freq[k][0]
         except KeyError:
-            if default:
+            if default is not None:
                 return default
             raise
-        except AttributeError as err:
-            if default:
+        except (TypeError, ValueError) as err:
+            if default is not None:
                 return default
             raise KeyError(f'Mapping error for {key}') from err
 
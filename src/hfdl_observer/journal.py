@@ -0,0 +1,150 @@
+# hfdl_observer/journal.py
+# copyright 2024 Kuupa Ork <kuupaork+github@hfdl.observer>
+# see LICENSE (or https://github.com/hfdl-observer/hfdlobserver888/blob/main/LICENSE) for terms of use.
+# TL;DR: BSD 3-clause
+#
+
+import datetime
+import json
+import logging
+import os
+import pathlib
+
+from typing import Any, Iterable, Union
+
+
+logger = logging.getLogger(__name__)
+
+# journal entries written before the journal is folded into a new snapshot.
+COMPACT_AFTER = 200
+
+
+def fsync_directory(path: pathlib.Path) -> None:
+    # makes a rename in `path` durable.
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class StateJournal:
+    # Persists a collection of records (dicts, each with a unique `key` field) so that a power cut cannot corrupt it.
+    # Changes are appended to a journal beside the snapshot, one JSON line per save, and fsync'd; every
+    # `compact_after` entries, the records are written to a new snapshot which atomically replaces the old one,
+    # and the journal starts afresh. Recovery is the snapshot plus whatever complete lines the journal holds. The
+    # snapshot keeps the plain `{<collection>: [...], "when": ...}` shape, so older state files still load.
+    records: dict[str, dict]
+    entries: int = 0
+
+    def __init__(
+        self,
+        path: Union[str, pathlib.Path],
+        collection: str,
+        key: str = 'id',
+        compact_after: int = COMPACT_AFTER,
+    ) -> None:
+        self.path = pathlib.Path(path)
+        self.journal_path = self.path.with_name(self.path.name + '.journal')
+        self.collection = collection
+        self.key = key
+        self.compact_after = compact_after
+        self.records = {}
+
+    def load(self) -> dict[str, dict]:
+        records: dict[str, dict] = {}
+        try:
+            snapshot = json.loads(self.path.read_text())
+        except FileNotFoundError:
+            pass
+        except (json.JSONDecodeError, IOError) as e:
+            logger.warning(f'ignoring unreadable snapshot {self.path}', exc_info=e)
+        else:
+            for record in snapshot.get(self.collection, []):
+                records[str(record[self.key])] = record
+        entries = 0
+        damaged = False
+        try:
+            with self.journal_path.open() as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # only the last line can be incomplete, cut short by whatever interrupted its writing.
+                        logger.warning(f'ignoring incomplete entry in {self.journal_path}')
+                        damaged = True
+                        break
+                    records.update(entry.get('set', {}))
+                    for key in entry.get('del', []):
+                        records.pop(key, None)
+                    entries += 1
+        except FileNotFoundError:
+            pass
+        except IOError as e:
+            logger.warning(f'ignoring unreadable journal {self.journal_path}', exc_info=e)
+        logger.debug(f'recovered {len(records)} records from {self.path} and {entries} journal entries')
+        self.records = records
+        self.entries = entries
+        if damaged:  # anything appended after the damage would not be recovered.
+            self.compact()
+        return records
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            self.collection: [self.records[k] for k in sorted(self.records, key=self.sort_key)],
+            'when': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+
+    @staticmethod
+    def sort_key(key: str) -> tuple[int, Union[int, str]]:
+        return (0, int(key)) if key.isdigit() else (1, key)
+
+    def record(self, changed: Iterable[dict], removed: Iterable[Any] = ()) -> bool:
+        # journals the records changed and the keys removed, if anything did; returns whether anything was written.
+        updates = {}
+        for record in changed:
+            key = str(record[self.key])
+            if self.records.get(key) != record:
+                updates[key] = record
+        deletions = [str(key) for key in removed if str(key) in self.records]
+        if not updates and not deletions:
+            return False
+        self.records.update(updates)
+        for key in deletions:
+            del self.records[key]
+        entry: dict[str, Any] = {'set': updates} if updates else {}
+        if deletions:
+            entry['del'] = deletions
+        with self.journal_path.open('a') as journal:
+            journal.write(json.dumps(entry, separators=(',', ':')) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+        self.entries += 1
+        if self.entries >= self.compact_after or not self.path.exists():
+            self.compact()
+        return True
+
+    def compact(self) -> None:
+        temporary = self.path.with_name(self.path.name + '.new')
+        with temporary.open('w') as snapshot:
+            snapshot.write(json.dumps(self.snapshot(), indent=4) + '\n')
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(temporary, self.path)
+        fsync_directory(self.path.parent)
+        # the snapshot now holds everything the journal did. Should this not happen, replaying the journal over the
+        # snapshot at recovery only arrives at the same records again.
+        try:
+            self.journal_path.unlink()
+        except FileNotFoundError:
+            pass
+        self.entries = 0
+        logger.debug(f'compacted {self.path}')
+
+    def __str__(self) -> str:
+        return f'<StateJournal: `{self.path}`>'
@@ -0,0 +1,156 @@
+# hfdl_observer/libconfig.py
+# copyright 2024 Kuupa Ork <kuupaork+github@hfdl.observer>
+# see LICENSE (or https://github.com/hfdl-observer/hfdlobserver888/blob/main/LICENSE) for terms of use.
+# TL;DR: BSD 3-clause
+#
+# A parser for the libconfig format dumphfdl uses for its system table (`systable.conf`, and the
+# `systable_updated.conf` it writes itself as it hears system table updates). Groups become dicts; arrays and lists
+# become lists.
+
+import collections
+import hashlib
+import re
+
+from typing import Any, Iterator
+
+
+# parsed documents, by content hash, most recently used last.
+CACHE_SIZE = 8
+_cache: collections.OrderedDict[str, dict[str, Any]] = collections.OrderedDict()
+
+TOKENS = re.compile(r'''
+    (?P<space>\s+)
+    | (?P<comment>\#[^\n]*|//[^\n]*|/\*.*?\*/)
+    | (?P<string>"(?:[^"\\]|\\.)*")
+    | (?P<float>[-+]?(?:\d+\.\d*|\.\d+)(?:[eE][-+]?\d+)?|[-+]?\d+[eE][-+]?\d+)
+    | (?P<hex>0[xX][0-9a-fA-F]+L{0,2})
+    | (?P<integer>[-+]?\d+L{0,2})
+    | (?P<boolean>(?i:true|false)\b)
+    | (?P<name>[A-Za-z\*][-A-Za-z0-9_\*]*)
+    | (?P<punctuation>[=:;,(){}\[\]])
+    | (?P<error>.)
+''', re.VERBOSE | re.DOTALL)
+ESCAPES = {'n': '\n', 'r': '\r', 't': '\t', 'f': '\f', '\\': '\\', '"': '"'}
+CLOSING = {'{': '}', '(': ')', '[': ']'}
+
+Token = tuple[str, str, int]  # kind, text, offset
+
+
+class LibconfigError(ValueError):
+    def __init__(self, message: str, text: str, offset: int) -> None:
+        line = text.count('\n', 0, offset) + 1
+        column = offset - text.rfind('\n', 0, offset)
+        super().__init__(f'{message} at line {line}, column {column}')
+        self.line = line
+        self.column = column
+
+
+def unescape(literal: str) -> str:
+    return re.sub(
+        r'\\(x[0-9a-fA-F]{2}|.)',
+        lambda m: chr(int(m[1][1:], 16)) if m[1][0] == 'x' else ESCAPES.get(m[1], m[1]),
+        literal[1:-1],
+    )
+
+
+def tokenize(text: str) -> Iterator[Token]:
+    for match in TOKENS.finditer(text):
+        kind = match.lastgroup
+        if kind == 'space' or kind == 'comment':
+            continue
+        if kind == 'error':
+            raise LibconfigError(f'unexpected `{match.group()}`', text, match.start())
+        yield kind, match.group(), match.start()  # type: ignore
+    yield 'end', '', len(text)
+
+
+class Parser:
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.tokens = tokenize(text)
+        self.current = next(self.tokens)
+
+    def advance(self) -> Token:
+        # moves on, returning the token moved past.
+        current = self.current
+        self.current = next(self.tokens)
+        return current
+
+    def error(self, message: str) -> LibconfigError:
+        return LibconfigError(message, self.text, self.current[2])
+
+    def expect(self, text: str) -> None:
+        if self.current[1] != text:
+            raise self.error(f'expected `{text}`, found `{self.current[1] or "end of input"}`')
+        self.advance()
+
+    def document(self) -> dict[str, Any]:
+        return self.settings('')  # the end token's text.
+
+    def settings(self, closing: str) -> dict[str, Any]:
+        result: dict[str, Any] = {}
+        while self.current[1] != closing:
+            kind, name, _ = self.current
+            if kind != 'name':
+                raise self.error(f'expected a setting name, found `{name or "end of input"}`')
+            self.advance()
+            if self.current[1] not in ('=', ':'):
+                raise self.error(f'expected `=` or `:` after `{name}`')
+            self.advance()
+            result[name] = self.value()
+            if self.current[1] in (';', ','):
+                self.advance()
+        return result
+
+    def value(self) -> Any:
+        kind, text, _ = self.current
+        if kind == 'punctuation' and text in CLOSING:
+            self.advance()
+            if text == '{':
+                value: Any = self.settings(CLOSING[text])
+            else:
+                value = self.values(CLOSING[text])
+            self.expect(CLOSING[text])
+            return value
+        if kind == 'string':
+            parts = []
+            while self.current[0] == 'string':  # adjacent strings are concatenated.
+                parts.append(unescape(self.advance()[1]))
+            return ''.join(parts)
+        if kind == 'float':
+            value = float(text)
+        elif kind == 'integer':
+            value = int(text.rstrip('L'))
+        elif kind == 'hex':
+            value = int(text.rstrip('L'), 16)
+        elif kind == 'boolean':
+            value = text.lower() == 'true'
+        else:
+            raise self.error(f'expected a value, found `{text or "end of input"}`')
+        self.advance()
+        return value
+
+    def values(self, closing: str) -> list[Any]:
+        result = []
+        while self.current[1] != closing:
+            result.append(self.value())
+            if self.current[1] == ',':
+                self.advance()
+            elif self.current[1] != closing:
+                raise self.error(f'expected `,` or `{closing}`, found `{self.current[1] or "end of input"}`')
+        return result
+
+
+def loads(text: str) -> dict[str, Any]:
+    # The same text is parsed only once; callers share the result, and must not change it.
+    digest = hashlib.sha256(text.encode()).hexdigest()
+    try:
+        _cache.move_to_end(digest)
+        return _cache[digest]
+    except KeyError:
+        pass
+    result = Parser(text).document()
+    _cache[digest] = result
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return result
@@ -7,40 +7,63 @@
 import asyncio
 import asyncio.protocols
 import collections
-import json
+import concurrent.futures
+import itertools
 import logging
+import multiprocessing
 
-from typing import Any, Callable, Union
+from typing import Any, Callable, Optional, Union
 
 import hfdl_observer.bus
+import hfdl_observer.codec
 import hfdl_observer.data
+import hfdl_observer.env
 import hfdl_observer.hfdl
 
 
 logger = logging.getLogger(__name__)
+DRAIN_BATCH_SIZE = 64
+# (raw line, source) as received. The source names the socket peer that sent the line.
+IngestedLine = tuple[str, str]
+PDU_MARKERS = ('"lpdu":', '"spdu":')
 
 
 class HFDLPacketConsumer:
     filters: list[Callable[[str], bool]]
     callbacks: list[Callable[[hfdl_observer.hfdl.HFDLPacketInfo], None]]
+    packet_types: Optional[hfdl_observer.hfdl.PacketType]
 
     def __init__(
-        self, filters: list[Callable[[str], bool]], callbacks: list[Callable[[hfdl_observer.hfdl.HFDLPacketInfo], None]]
+        self,
+        filters: list[Callable[[str], bool]],
+        callbacks: list[Callable[[hfdl_observer.hfdl.HFDLPacketInfo], None]],
+        packet_types: Optional[hfdl_observer.hfdl.PacketType] = None,
     ) -> None:
         self.filters = filters or []
         self.callbacks = callbacks if callbacks is not None else []
+        self.packet_types = packet_types
 
-    def matches(self, packet_str: str) -> bool:
+    def matches(self, packet_str: str, packet: Optional[hfdl_observer.hfdl.HFDLPacketInfo] = None) -> bool:
+        if self.packet_types is not None and packet is not None:
+            return bool(packet.packet_types & self.packet_types)
         for filter in self.filters:
             if filter(packet_str):
                 return True
         return False
 
     def consume(self, packet_str: str, packet: hfdl_observer.hfdl.HFDLPacketInfo) -> None:
-        if self.matches(packet_str):
+        if self.matches(packet_str, packet):
             for callback in self.callbacks:
                 callback(packet)
 
+    @classmethod
+    def for_types(
+        cls,
+        packet_types: hfdl_observer.hfdl.PacketType,
+        callbacks: list[Callable[[hfdl_observer.hfdl.HFDLPacketInfo], None]],
+    ) -> 'HFDLPacketConsumer':
+        return cls([], callbacks, packet_types)
+
     @classmethod
     def any_in(cls, *terms: str) -> Callable[[str], bool]:
         return lambda s: any(x in s for x in terms)
@@ -50,12 +73,306 @@ class HFDLPacketConsumer:
         return lambda s: all(x in s for x in terms)
 
 
-class UDPProtocol(asyncio.protocols.BaseProtocol):
+class HFDLPacketDispatcher:
+    # Routes packets to consumers by their structural type. Each packet is classified once (see
+    # `HFDLPacketInfo.packet_types`), and the consumers interested in that combination of types are looked up in a
+    # routing table that is filled on demand. Consumers that still use text filters are routed for every packet, and
+    # keep paying for their own scan.
     consumers: list[HFDLPacketConsumer]
+    routes: dict[int, tuple[HFDLPacketConsumer, ...]]
+
+    def __init__(self, consumers: Optional[list[HFDLPacketConsumer]] = None) -> None:
+        self.consumers = []
+        self.routes = {}
+        for consumer in consumers or []:
+            self.add_consumer(consumer)
+
+    def add_consumer(self, consumer: HFDLPacketConsumer) -> None:
+        self.consumers.append(consumer)
+        self.routes = {}
+
+    def route(self, packet_types: hfdl_observer.hfdl.PacketType) -> tuple[HFDLPacketConsumer, ...]:
+        try:
+            return self.routes[packet_types]
+        except KeyError:
+            route = self.routes[packet_types] = tuple(
+                consumer for consumer in self.consumers
+                if consumer.packet_types is None or consumer.packet_types & packet_types
+            )
+            return route
+
+    def dispatch(self, packet_str: str, packet: hfdl_observer.hfdl.HFDLPacketInfo) -> None:
+        # a consumer that fails on a packet is logged and skipped; the others, and later packets, are unaffected.
+        for consumer in self.route(packet.packet_types):
+            try:
+                if consumer.packet_types is None:
+                    consumer.consume(packet_str, packet)
+                else:
+                    for callback in consumer.callbacks:
+                        callback(packet)
+            except Exception as err:
+                logger.error(f'consumer failed on packet {packet}', exc_info=err)
+
+
+class DuplicateFilter:
+    # Overlapping passbands, and retunes that briefly run two decoders on one channel, can deliver the same frame
+    # more than once. A frame is identified by its frequency, its timestamp, and a digest of its PDU; frames seen in
+    # the last `horizon` seconds (of frame time), up to `maxsize` of them, are remembered, and repeats are
+    # suppressed. Suppressions are counted per pair of sources.
+    # The digest is taken from the raw line: dumphfdl writes the PDU last, after the fields that differ between
+    # decoders (station, signal levels, skew), and hashing that text is far cheaper than hashing the decoded PDU.
+    frames: collections.OrderedDict[tuple, tuple[str, float]]
+    suppressed: collections.Counter[tuple[str, str]]
+    duplicates: int = 0
+
+    def __init__(self, horizon: float = 10.0, maxsize: int = 4096) -> None:
+        self.horizon = horizon
+        self.maxsize = maxsize
+        self.frames = collections.OrderedDict()
+        self.suppressed = collections.Counter()
+
+    def digest(self, line: str) -> int:
+        for marker in PDU_MARKERS:
+            index = line.find(marker)
+            if index >= 0:
+                return hash(line[index:])
+        return hash(line)
+
+    def is_duplicate(self, line: str, packet: hfdl_observer.hfdl.HFDLPacketInfo, source: str) -> bool:
+        t = packet.packet['t']
+        usec = t.get('usec', 0)
+        key = (packet.frequency, t['sec'], usec, self.digest(line))
+        frames = self.frames
+        try:
+            first_source, _ = frames[key]
+        except KeyError:
+            pass
+        else:
+            self.duplicates += 1
+            self.suppressed[(first_source, source) if first_source <= source else (source, first_source)] += 1
+            return True
+        when = t['sec'] + usec / 1e6
+        frames[key] = (source, when)
+        # frames arrive in (roughly) time order, so the oldest are at the front.
+        oldest = when - self.horizon
+        while len(frames) > self.maxsize or next(iter(frames.values()))[1] < oldest:
+            frames.popitem(last=False)
+        return False
+
+    def stats(self) -> dict[str, int]:
+        return {f'{a}|{b}': count for (a, b), count in self.suppressed.items()}
+
+
+# (raw line, compact packet, packet types, source) as produced by a decode worker. The packet is cut down to what
+# the consumers read (see `HFDLPacketInfo.compact`), which makes it about 40% cheaper to unpickle on the loop. The raw
+# line is kept whole, for the duplicate filter's digest and any consumers filtering on text.
+PacketRecord = tuple[str, dict[str, Any], int, str]
+_worker_decoders: dict[str, hfdl_observer.codec.JSONDecoder] = {}
+
+
+def decode_lines(decoder_name: str, lines: list[IngestedLine]) -> tuple[list[PacketRecord], int]:
+    # Runs in a decode worker process. Returns the decodable packets, classified, and a count of the garbage lines.
+    try:
+        decode = _worker_decoders[decoder_name]
+    except KeyError:
+        decode = _worker_decoders[decoder_name] = hfdl_observer.codec.get_decoder(decoder_name)
+    records: list[PacketRecord] = []
+    garbage = 0
+    for line, source in lines:
+        try:
+            packet = hfdl_observer.hfdl.HFDLPacketInfo(decode(line))
+            records.append((line, packet.compact(), int(packet.packet_types), source))
+        except (AttributeError, KeyError, TypeError, *hfdl_observer.codec.DECODE_ERRORS):
+            garbage += 1
+    return records, garbage
 
-    def __init__(self, hfdl_consumers: list[HFDLPacketConsumer]):
+
+class DecodeStage:
+    # Decodes lines on the event loop, and dispatches the packets.
+    duplicates: Optional[DuplicateFilter]
+
+    def __init__(
+        self,
+        dispatcher: HFDLPacketDispatcher,
+        decoder_name: str = 'auto',
+        duplicates: Optional[DuplicateFilter] = None,
+    ) -> None:
+        self.dispatcher = dispatcher
+        self.decoder_name = decoder_name
+        self.decoder = hfdl_observer.codec.get_decoder(decoder_name)
+        self.duplicates = duplicates
+
+    async def ready(self) -> None:
+        # waits until the stage can take more lines.
+        pass
+
+    def submit(self, lines: list[IngestedLine]) -> None:
+        decode = self.decoder
+        dispatch = self.dispatcher.dispatch
+        is_duplicate = self.duplicates.is_duplicate if self.duplicates else None
+        for line, source in lines:
+            try:
+                packet = hfdl_observer.hfdl.HFDLPacketInfo(decode(line))
+                packet.packet_types  # classified here, so that a malformed PDU is dropped like any other garbage.
+            except (AttributeError, KeyError, TypeError, *hfdl_observer.codec.DECODE_ERRORS) as err:
+                logger.warn(f"dropping garbage: {line}", exc_info=err)
+            else:
+                if is_duplicate and is_duplicate(line, packet, source):
+                    logger.debug(f"duplicate packet from {source}")
+                    continue
+                logger.info(f"packet {packet}")
+                dispatch(line, packet)
+
+    def shutdown(self) -> None:
+        pass
+
+
+class DecodePool(DecodeStage):
+    # Moves packet decoding off the event loop, into a pool of worker processes. Lines are gathered into batches
+    # (flushed by size or age), and the decoded batches are dispatched in the order they were submitted. No more than
+    # `max_batches` batches are handed to the workers at once; while that many are, the pool is not ready for more
+    # lines, so they back up in the ingest queue, where its overflow policy applies.
+    in_flight: collections.deque[asyncio.Future]
+    pending: list[IngestedLine]
+    flush_handle: Optional[asyncio.Handle] = None
+
+    def __init__(
+        self,
+        dispatcher: HFDLPacketDispatcher,
+        decoder_name: str = 'auto',
+        duplicates: Optional[DuplicateFilter] = None,
+        workers: int = 1,
+        batch_size: int = 64,
+        batch_interval: float = 0.05,
+        max_batches: Optional[int] = None,
+    ) -> None:
+        super().__init__(dispatcher, decoder_name, duplicates)
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.max_batches = max_batches or 2 * workers
+        self.capacity = asyncio.Event()
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('spawn')
+        )
+        self.pending = []
+        self.in_flight = collections.deque()
+
+    @property
+    def saturated(self) -> bool:
+        return len(self.in_flight) >= self.max_batches
+
+    async def ready(self) -> None:
+        while self.saturated:
+            self.capacity.clear()
+            await self.capacity.wait()
+
+    def submit(self, lines: list[IngestedLine]) -> None:
+        self.pending.extend(lines)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.batch_interval, self.flush)
+
+    def flush(self) -> None:
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.pending or self.saturated:  # a saturated pool flushes when a batch comes back.
+            return
+        lines, self.pending = self.pending, []
+        future = asyncio.get_running_loop().run_in_executor(self.executor, decode_lines, self.decoder_name, lines)
+        self.in_flight.append(future)
+        future.add_done_callback(self.on_decoded)
+
+    def on_decoded(self, _: asyncio.Future) -> None:
+        dispatch = self.dispatcher.dispatch
+        is_duplicate = self.duplicates.is_duplicate if self.duplicates else None
+        while self.in_flight and self.in_flight[0].done():
+            future = self.in_flight.popleft()
+            try:
+                records, garbage = future.result()
+            except (asyncio.CancelledError, Exception) as err:
+                logger.warning('dropping a batch of packets', exc_info=err)
+                continue
+            if garbage:
+                logger.debug(f"dropped {garbage} garbage lines")
+            for line, packet_data, packet_types, source in records:
+                packet = hfdl_observer.hfdl.HFDLPacketInfo(packet_data, hfdl_observer.hfdl.PacketType(packet_types))
+                if is_duplicate and is_duplicate(line, packet, source):
+                    logger.debug(f"duplicate packet from {source}")
+                    continue
+                logger.info(f"packet {packet}")
+                dispatch(line, packet)
+        if not self.saturated:
+            if self.pending and self.flush_handle is None:
+                self.flush()
+            self.capacity.set()
+
+    def shutdown(self) -> None:
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class IngestQueue:
+    # A bounded buffer between the sockets and the decode stage, so that slow consumers do not stall socket reads
+    # (where the kernel would silently drop datagrams). When full, either the oldest or the newest line is dropped,
+    # and the loss is counted.
+    DROP_OLDEST = 'drop-oldest'
+    DROP_NEWEST = 'drop-newest'
+
+    lines: collections.deque[IngestedLine]
+    enqueued: int = 0
+    dropped: int = 0
+    max_depth: int = 0
+
+    def __init__(self, maxsize: int = 4096, overflow: str = DROP_OLDEST) -> None:
+        if overflow not in (self.DROP_OLDEST, self.DROP_NEWEST):
+            raise ValueError(f'unknown overflow policy `{overflow}`')
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.lines = collections.deque()
+        self.ready = asyncio.Event()
+
+    def put(self, line: str, source: str = '') -> bool:
+        if len(self.lines) >= self.maxsize:
+            self.dropped += 1
+            if self.overflow == self.DROP_NEWEST:
+                return False
+            self.lines.popleft()
+        self.lines.append((line, source))
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, len(self.lines))
+        self.ready.set()
+        return True
+
+    def take(self, limit: int) -> list[IngestedLine]:
+        lines = self.lines
+        return [lines.popleft() for _ in range(min(limit, len(lines)))]
+
+    async def wait(self) -> None:
+        if not self.lines:
+            self.ready.clear()
+            await self.ready.wait()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            'max_depth': self.max_depth,
+            'depth': len(self.lines),
+        }
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+
+class UDPProtocol(asyncio.protocols.BaseProtocol):
+    queue: IngestQueue
+
+    def __init__(self, queue: IngestQueue):
         self.buffers: dict = collections.defaultdict(lambda: '')
-        self.consumers = hfdl_consumers
+        self.queue = queue
 
     def connection_made(self, transport: asyncio.BaseTransport) -> None:
         self.transport = transport
@@ -68,64 +385,190 @@ class UDPProtocol(asyncio.protocols.BaseProtocol):
         self.buffers[addr] += message
         *head, tail = self.buffers[addr].split('\n')
 
+        put = self.queue.put
+        source = f'{addr[0]}:{addr[1]}'
         for line in head:
             line = line.strip()
             if not line.startswith('{'):
                 logger.debug(f"dropping garbage: {line}")
                 continue
-            try:
-                packet_data = json.loads(line)
-            except json.JSONDecodeError as err:
-                logger.warn(f"dropping garbage: {line}", exc_info=err)
-            else:
-                packet = hfdl_observer.hfdl.HFDLPacketInfo(packet_data)
-                logger.info(f"packet {packet}")
-                # self.on_hfdl(packet)
-                for consumer in self.consumers:
-                    consumer.consume(line, packet)
+            put(line, source)
         if tail and len(tail) < 65536:  # primitive/naive stuffing check.
             self.buffers[addr] = tail
         else:
             del self.buffers[addr]
 
 
+class StreamProtocol(asyncio.BufferedProtocol):
+    # One per connection (from dumphfdl's TCP output, or anything bridged to a Unix socket). Data is received into a
+    # preallocated buffer and lines are framed in place, so a connection is lossless and needs no per-read string
+    # concatenation.
+    queue: IngestQueue
+    filled: int = 0
+    connections = itertools.count(1)
+
+    def __init__(self, queue: IngestQueue, buffer_size: int = 65536):
+        self.queue = queue
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport
+        self.peer = transport.get_extra_info('peername') or transport.get_extra_info('sockname')
+        if isinstance(self.peer, tuple):
+            self.source = f'{self.peer[0]}:{self.peer[1]}'
+        else:  # Unix socket peers are anonymous
+            self.source = f'{self.peer}#{next(self.connections)}'
+        logger.info(f'stream connected from {self.peer}')
+
+    def connection_lost(self, exc: Union[None, Exception]) -> None:
+        logger.info(f'stream from {self.peer} closed')
+        if exc:
+            logger.warning(f'stream error from {self.peer}', exc_info=exc)
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        if self.filled >= len(self.buffer):
+            # no newline in a whole buffer. primitive/naive stuffing check.
+            logger.debug(f'dropping {self.filled} bytes of garbage from {self.peer}')
+            self.filled = 0
+        return self.view[self.filled:]
+
+    def buffer_updated(self, nbytes: int) -> None:
+        buffer = self.buffer
+        view = self.view
+        end = self.filled + nbytes
+        start = 0
+        put = self.queue.put
+        source = self.source
+        while (newline := buffer.find(b'\n', start, end)) >= 0:
+            try:
+                line = str(view[start:newline], 'utf8').strip()
+            except UnicodeDecodeError:
+                line = ''
+            if line.startswith('{'):
+                put(line, source)
+            elif line:
+                logger.debug(f"dropping garbage: {line}")
+            start = newline + 1
+        if start:
+            # move the partial line (if any) to the front of the buffer.
+            buffer[:end - start] = buffer[start:end]
+        self.filled = end - start
+
+
 class HFDLListener(hfdl_observer.bus.Publisher):
+    queue: IngestQueue
+    duplicates: Optional[DuplicateFilter] = None
+    server: Optional[asyncio.AbstractServer] = None
+    transport: Optional[asyncio.BaseTransport] = None
+
     def __init__(self, settings: dict) -> None:
+        super().__init__()
         self.settings = settings
-
-    async def run(self, hfdl_consumers: list[HFDLPacketConsumer]) -> None:
-        logger.debug('running HFDL UDP listener')
-        self.transport, self.protocol = await asyncio.get_running_loop().create_datagram_endpoint(
-            lambda: UDPProtocol(hfdl_consumers),
-            local_addr=(self.settings['address'], self.settings['port']),
+        self.queue = IngestQueue(
+            self.settings.get('queue_size', 4096), self.settings.get('queue_overflow', IngestQueue.DROP_OLDEST)
         )
+        dedup_horizon = self.settings.get('dedup_horizon', 10)
+        if dedup_horizon:
+            self.duplicates = DuplicateFilter(dedup_horizon, self.settings.get('dedup_size', 4096))
+
+    def decode_stage(self, dispatcher: HFDLPacketDispatcher) -> DecodeStage:
+        decoder_name = self.settings.get('json_decoder', 'auto')
+        workers = self.settings.get('decode_workers', 0)
+        if workers:
+            logger.info(f'decoding packets with {workers} worker processes')
+            return DecodePool(
+                dispatcher,
+                decoder_name,
+                self.duplicates,
+                workers,
+                batch_size=self.settings.get('decode_batch_size', 64),
+                batch_interval=self.settings.get('decode_batch_interval', 0.05),
+                max_batches=self.settings.get('decode_max_batches'),
+            )
+        return DecodeStage(dispatcher, decoder_name, self.duplicates)
+
+    async def drain(self, stage: DecodeStage) -> None:
+        while True:
+            await self.queue.wait()
+            await stage.ready()
+            try:
+                stage.submit(self.queue.take(DRAIN_BATCH_SIZE))
+            except Exception as err:  # the batch is lost, but not the lines behind it.
+                logger.error('failed to process a batch of packets', exc_info=err)
+            await asyncio.sleep(0)  # let the sockets in.
+
+    def stats(self) -> dict[str, int]:
+        stats = self.queue.stats()
+        if self.duplicates:
+            stats['duplicates'] = self.duplicates.duplicates
+        return stats
+
+    @property
+    def proto(self) -> str:
+        return str(self.settings.get('proto', 'udp'))
+
+    async def listen(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self.proto == 'udp':
+            self.transport, _ = await loop.create_datagram_endpoint(
+                lambda: UDPProtocol(self.queue),
+                local_addr=(self.settings['address'], self.settings['port']),
+            )
+        elif self.proto == 'tcp':
+            self.server = await loop.create_server(
+                lambda: StreamProtocol(self.queue), host=self.settings['address'], port=self.settings['port'],
+            )
+        elif self.proto == 'unix':
+            path = hfdl_observer.env.as_path(self.settings['path'])
+            path.unlink(missing_ok=True)  # stale from a previous run
+            self.server = await loop.create_unix_server(lambda: StreamProtocol(self.queue), path=str(path))
+        else:
+            raise ValueError(f'unsupported HFDL listener protocol `{self.proto}`')
+
+    async def run(self, hfdl_consumers: list[HFDLPacketConsumer], listen: bool = True) -> None:
+        logger.debug(f'running HFDL {self.proto} listener')
+        stage = self.decode_stage(HFDLPacketDispatcher(hfdl_consumers))
+        drain_task = asyncio.get_running_loop().create_task(self.drain(stage))
         try:
+            if listen:
+                await self.listen()
             while True:
-                await asyncio.sleep(60)
+                await asyncio.sleep(self.settings.get('queue_stats_period', 60))
+                self.publish('ingest', self.stats())
         finally:
-            try:
-                self.transport.close()
-            except RuntimeError:
-                pass
-        logger.debug('HFDL UDP listener done')
+            self.stop()
+            drain_task.cancel()
+            stage.shutdown()
+        logger.debug(f'HFDL {self.proto} listener done')
 
-    def start(self, hfdl_consumers: list[HFDLPacketConsumer]) -> None:
+    def start(self, hfdl_consumers: list[HFDLPacketConsumer], listen: bool = True) -> None:
+        # without `listen`, no socket is opened; packets only arrive through `queue` (eg. from a replay).
         try:
-            self.settings['address']
-            self.settings['port']
+            if self.proto == 'unix':
+                self.settings['path']
+            else:
+                self.settings['address']
+                self.settings['port']
         except KeyError:
             logger.warn('Missing HFDL Listener configuration, not starting one.')
         else:
-            asyncio.get_running_loop().create_task(self.run(hfdl_consumers))
+            asyncio.get_running_loop().create_task(self.run(hfdl_consumers, listen))
 
     def stop(self) -> None:
-        if self.transport:
-            self.transport.close()
+        try:
+            if self.transport:
+                self.transport.close()
+            if self.server:
+                self.server.close()
+        except RuntimeError:
+            pass
 
     @property
     def listener(self) -> hfdl_observer.data.ListenerConfig:
         config = hfdl_observer.data.ListenerConfig()
-        config.proto = 'udp'  # all that is supported
-        config.address = self.settings['address']
-        config.port = self.settings['port']
+        config.proto = self.proto
+        config.address = self.settings.get('address', config.address)
+        config.port = self.settings.get('port', config.port)
+        config.path = self.settings.get('path')
         return config
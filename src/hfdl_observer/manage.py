@@ -7,7 +7,7 @@
 import asyncio
 import datetime
 import functools
-import json
+import itertools
 import logging
 
 from typing import Any, Callable, Coroutine, Optional, Union
@@ -17,13 +17,17 @@ import hfdl_observer.env
 import hfdl_observer.data
 import hfdl_observer.groundstation
 import hfdl_observer.hfdl
+import hfdl_observer.journal
 
 
 logger = logging.getLogger(__name__)
 
 
 class ActiveGroundStations(hfdl_observer.groundstation.GroundStationStatus):
-    last_state: dict
+    journal: Optional[hfdl_observer.journal.StateJournal] = None
+    last_frequencies: dict[int, list[int]]
+    last_strata: dict[int, int]
+    last_systable: dict[int, list[int]]
     hfdl_watchers: list[hfdl_observer.groundstation.GroundStationTable]
     startables: list[Callable[[], Coroutine[Any, Any, None]]]
     tasks: list[asyncio.Task]
@@ -33,7 +37,7 @@ class ActiveGroundStations(hfdl_observer.groundstation.GroundStationStatus):
         super().__init__()
         self.will_save = False
         self.config = config
-        self.save_path = hfdl_observer.env.as_path(config['state'])
+        self.save_path = hfdl_observer.env.as_path(config['state']) if config.get('state') else None
         self.hfdl_watchers = []
         self.tasks = []
         self.startables = []
@@ -52,31 +56,35 @@ class ActiveGroundStations(hfdl_observer.groundstation.GroundStationStatus):
             table = hfdl_observer.groundstation.AirframesStationTable()
             url_watcher = hfdl_observer.bus.RemoteURLRefresher(
                 url_source['url'],
-                period=url_source.get('period', 60 + ix)
+                period=url_source.get('period', 60 + ix),
+                timeout=url_source.get('timeout', hfdl_observer.bus.HTTP_TIMEOUT),
             )
             url_watcher.subscribe('response', table.update)
+            url_watcher.subscribe('unchanged', table.refresh)
             self.startables.append(url_watcher.run)
             self.add_table(table)
         if self.save_path:
-            try:
-                previous = json.loads(self.save_path.read_text())
-            except (json.JSONDecodeError, IOError):
-                pass
-            else:
+            self.journal = hfdl_observer.journal.StateJournal(
+                self.save_path, 'ground_stations', compact_after=config.get('compact_after', 200)
+            )
+            previous = self.journal.load()
+            if previous:
                 logger.debug("loading previous state")
                 previous_table = hfdl_observer.groundstation.AirframesStationTable()
-                previous_table.update(previous)
+                previous_table.update({'ground_stations': list(previous.values())})
                 self.add_table(previous_table)
         for file_source in [hfdl_observer.env.as_path(p) for p in config.get('station_files', [])]:
             table = hfdl_observer.groundstation.SystemTable()
-            file_watcher = hfdl_observer.bus.FileRefresher(file_source, period=3600)
+            file_watcher = hfdl_observer.bus.FileRefresher(file_source, backstop=3600)
             assert file_source.exists(), f'{file_source} does not exist'
             file_watcher.subscribe('text', table.update)
             self.startables.append(file_watcher.run)
             self.add_table(table)
             self.systable = table
         self.subscribe('update', self.schedule_save)
-        self.last_state = dict()
+        self.last_frequencies = {}
+        self.last_strata = {}
+        self.last_systable = {}
 
     def start(self) -> None:
         loop = asyncio.get_running_loop()
@@ -116,7 +124,7 @@ class ActiveGroundStations(hfdl_observer.groundstation.GroundStationStatus):
         }
         station = self[station_key]
         data['id'] = station.id
-        name = station.name or hfdl_observer.hfdl.STATIONS.get(station.id).get('name')
+        name = station.name or hfdl_observer.hfdl.STATIONS.station(station.id, {}).get('name')
         if name is None:
             # hacky way to backfill. Should never be needed?
             station_data = self.cached_station_strata[station.id]
@@ -127,7 +135,6 @@ class ActiveGroundStations(hfdl_observer.groundstation.GroundStationStatus):
                         break
         data['name'] = name
         data['last_updated'] = station.last_updated
-        data['when'] = datetime.datetime.now(datetime.timezone.utc).isoformat()
         data['frequencies'] = {
             'active': sorted(self.active_frequencies(station_key)),
             'stratum': station.stratum.value,
@@ -140,20 +147,36 @@ class ActiveGroundStations(hfdl_observer.groundstation.GroundStationStatus):
             self.will_save = True
             asyncio.get_running_loop().call_later(self.config['save_delay'], self.save)
 
+    def current_strata(self) -> dict[int, int]:
+        return {sid: self[sid].stratum.value for sid in self.station_ids}
+
+    def systable_frequencies(self) -> dict[int, list[int]]:
+        if not self.systable:
+            return {}
+        return {station.id: sorted(station.khz()) for station in self.systable.stations(None)}
+
     def save(self) -> None:
         logger.debug('ground stations frequencies')
-        self.publish('frequencies', self.active_station_frequencies)
-        if self.save_path:
-            data: dict = {
-                'ground_stations': list(self.active_station_data(k) for k in sorted(self.station_ids)),
-            }
-            self.will_save = False
-            when = datetime.datetime.now(datetime.timezone.utc).isoformat()
-            if data != self.last_state:
-                logger.info('saving station data')
-                self.last_state = data.copy()
-                data['when'] = when
-                self.save_path.write_text(json.dumps(data, indent=4) + '\n')
+        frequencies = self.active_station_frequencies
+        strata = self.current_strata()
+        systable = self.systable_frequencies()
+        delta = hfdl_observer.data.FrequencyDelta(
+            self.last_frequencies, frequencies, self.last_strata, strata, self.last_systable, systable
+        )
+        if delta:
+            self.last_frequencies = frequencies
+            self.last_strata = strata
+            self.last_systable = systable
+            self.publish('delta', delta)
+            self.publish('frequencies', frequencies)
+        self.will_save = False
+        if self.journal:
+            # only the stations that changed are written.
+            current = [self.active_station_data(k) for k in self.station_ids]
+            ids = {str(data['id']) for data in current}
+            removed = [key for key in self.journal.records if key not in ids]
+            if self.journal.record(current, removed):
+                logger.info('saved station data')
 
 
 class ReceiverProxy(hfdl_observer.bus.Publisher):
@@ -203,16 +226,66 @@ class ReceiverProxy(hfdl_observer.bus.Publisher):
         self.send('listen', freqs)
 
 
+def max_coverage(weights: dict[int, float], span: float, count: int) -> list[list[int]]:
+    # Chooses up to `count` groups of frequencies, each spanning no more than `span` kHz, to cover the most weight.
+    # A DP over the sorted frequencies: best[k][i] is the most weight `k` groups can cover among the first `i`
+    # frequencies, where the last group, if any, ends at frequency i - 1 and reaches back as far as `span` allows.
+    # O(count * n). Returns the groups, heaviest first.
+    freqs = sorted(weights)
+    n = len(freqs)
+    prefix = [0.0]
+    for f in freqs:
+        prefix.append(prefix[-1] + weights[f])
+    reach = []  # for each frequency, the first one a group ending on it can include.
+    start = 0
+    for end, f in enumerate(freqs):
+        while f - freqs[start] > span:
+            start += 1
+        reach.append(start)
+    best = [[0.0] * (n + 1) for _ in range(count + 1)]
+    ends = [[False] * (n + 1) for _ in range(count + 1)]  # whether a group ends on frequency i - 1.
+    for k in range(1, count + 1):
+        previous, current, ending = best[k - 1], best[k], ends[k]
+        for i in range(1, n + 1):
+            start = reach[i - 1]
+            covered = previous[start] + prefix[i] - prefix[start]
+            if covered > current[i - 1]:
+                current[i] = covered
+                ending[i] = True
+            else:
+                current[i] = current[i - 1]
+    groups = []
+    k, i = count, n
+    while k > 0 and i > 0:
+        if ends[k][i]:
+            start = reach[i - 1]
+            groups.append(freqs[start:i])
+            k, i = k - 1, start
+        else:
+            i -= 1
+    groups.sort(key=lambda group: (-sum(weights[f] for f in group), group[0]))
+    return groups
+
+
 class SimpleConductor(hfdl_observer.bus.Publisher):  # proxyPublisher
     ranked_station_ids: list[int]
     ignored_frequencies: list[tuple[int, int]]
     allowed_allocation_width: int
     proxies: list[ReceiverProxy]
+    ranks: dict[int, int]
+    # the rank of the first station with an active frequency left without a receiver at the last allocation.
+    cutoff_rank: Optional[int] = None
+    # the allocations last orchestrated; None until then.
+    current: Optional[list[hfdl_observer.data.Allocation]] = None
+    # the (inactive) frequencies the last field allocations were made from, and whether they left a receiver idle.
+    field_frequencies: Optional[dict[int, list[int]]] = None
+    spare_receivers: bool = False
 
     def __init__(self, config: dict) -> None:
         super().__init__()
         self.config = config
         self.ranked_station_ids = config['ranked_stations']
+        self.ranks = {sid: rank for rank, sid in enumerate(self.ranked_station_ids)}
         ignores = config.get('ignored_frequencies', [])
         self.ignored_frequencies = ignored = []
         for ignore in ignores:
@@ -246,20 +319,109 @@ class SimpleConductor(hfdl_observer.bus.Publisher):  # proxyPublisher
         station_frequencies: dict[int, list[int]],
         base_allocations: Optional[list[hfdl_observer.data.Allocation]] = None
     ) -> list[hfdl_observer.data.Allocation]:
+        # Field allocations (with `base_allocations`) are always filled first-fit, so each stays an extension of the
+        # target allocation at the same index.
+        if base_allocations is None and self.config.get('allocator', 'greedy') == 'coverage':
+            return self.allocate_coverage(station_frequencies)
         allocations: list[hfdl_observer.data.Allocation] = []
         for a in base_allocations or []:
             allocations.append(self.parameters.allocation(a.frequencies))
-        for sid in self.ranked_station_ids:
+        cutoff_rank = None
+        for rank, sid in enumerate(self.ranked_station_ids):
             for frequency in sorted(station_frequencies.get(sid, [])):
                 if self.is_ignored(frequency):
                     continue
-                for allocation in allocations:
+                for ix, allocation in enumerate(allocations):
                     if allocation.maybe_add(frequency):
                         break
                 else:
+                    ix = len(allocations)
                     allocations.append(self.parameters.allocation([frequency]))
+                if cutoff_rank is None and ix >= len(self.proxies):
+                    cutoff_rank = rank
+        if base_allocations is None:
+            self.cutoff_rank = cutoff_rank
+        else:
+            self.field_frequencies = station_frequencies
+            self.spare_receivers = len(allocations) < len(self.proxies)
         return allocations
 
+    def allocate_coverage(self, station_frequencies: dict[int, list[int]]) -> list[hfdl_observer.data.Allocation]:
+        # Gives the receivers the allocations covering the most rank-weighted frequencies (a frequency shared by
+        # several stations weighs their sum); what is left over is allocated first-fit after them, as by the greedy
+        # allocator.
+        weights: dict[int, float] = {}
+        ranked = len(self.ranked_station_ids)
+        for rank, sid in enumerate(self.ranked_station_ids):
+            for frequency in station_frequencies.get(sid, []):
+                if not self.is_ignored(frequency):
+                    weights[frequency] = weights.get(frequency, 0.0) + ranked - rank
+        span = self.parameters.max_sample_rate - hfdl_observer.hfdl.HFDL_CHANNEL_WIDTH
+        groups = max_coverage(weights, span, len(self.proxies))
+        allocations = [self.parameters.allocation(group) for group in groups]
+        covered = set(itertools.chain.from_iterable(groups))
+        for frequency in sorted(weights, key=lambda f: -weights[f]):
+            if frequency in covered:
+                continue
+            for allocation in allocations[len(groups):]:
+                if allocation.maybe_add(frequency):
+                    break
+            else:
+                allocations.append(self.parameters.allocation([frequency]))
+        # any change to a ranked station may move the optimum; there is no rank below which changes can be ignored.
+        self.cutoff_rank = None
+        return allocations
+
+    def affects(
+        self,
+        delta: hfdl_observer.data.FrequencyDelta,
+        inactive_frequencies: Optional[dict[int, list[int]]] = None,
+    ) -> bool:
+        # whether allocating for `delta.frequencies` (and `inactive_frequencies` for the field allocations) could
+        # assign any receiver differently from the last time. Conservative: a changed frequency matters if it could
+        # join or leave one of the current allocations, belongs to a station ranked high enough to have displaced
+        # one, or is a field frequency that could be given to an idle receiver.
+        if self.current is None or delta.systable:
+            return True  # field allocations are made from the system table frequencies.
+        if any(not any(proxy.covers(a) for proxy in self.proxies) for a in self.current):
+            return True  # a receiver is not (or no longer) listening where it was told to.
+        reach = self.parameters.max_sample_rate
+        # changes from stations ranked below the cutoff, and to field frequencies, indexed by frequency to be looked
+        # up by passband.
+        lower: dict[int, dict] = {}
+        for changes in (delta.added, delta.removed):
+            for sid, frequencies in changes.items():
+                rank = self.ranks.get(sid)
+                if rank is None:
+                    continue
+                frequencies = [f for f in frequencies if not self.is_ignored(f)]
+                if not frequencies:
+                    continue
+                if self.cutoff_rank is None or rank <= self.cutoff_rank:
+                    return True
+                lower.setdefault(sid, {'id': sid, 'frequencies': []})['frequencies'].extend(frequencies)
+        if inactive_frequencies is not None:
+            if self.field_frequencies is None:
+                return True
+            field_delta = hfdl_observer.data.FrequencyDelta(self.field_frequencies, inactive_frequencies)
+            for changes in (field_delta.added, field_delta.removed):
+                for sid, frequencies in changes.items():
+                    if sid not in self.ranks:
+                        continue
+                    frequencies = [f for f in frequencies if not self.is_ignored(f)]
+                    if not frequencies:
+                        continue
+                    if self.spare_receivers:
+                        return True
+                    lower.setdefault(sid, {'id': sid, 'frequencies': []})['frequencies'].extend(frequencies)
+        if lower:
+            changed = hfdl_observer.hfdl.StationLookup()
+            changed.update(lower)
+            for allocation in self.current:
+                if allocation.frequencies and changed.within(allocation.min - reach, allocation.max + reach):
+                    return True
+        return False
+
     def orchestrate(
         self,
         allocations: list[hfdl_observer.data.Allocation],
@@ -307,6 +469,7 @@ class SimpleConductor(hfdl_observer.bus.Publisher):  # proxyPublisher
             logger.info(f'assigned {field_allocation.frequencies} to {receiver.name} (was {receiver_freqs})')
             self.reaper.add_allocation(field_allocation)
 
+        self.current = [a for a in desired_target_allocations + desired_field_allocations if a.frequencies]
         diff = field_listening_count - target_listening_count
         logger.info(f'Listening to {target_listening_count} of {all_freq_count} active frequencies (+{diff} extra)')
         return desired_target_allocations, desired_field_allocations
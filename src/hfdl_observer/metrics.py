@@ -0,0 +1,306 @@
+# hfdl_observer/metrics.py
+# copyright 2024 Kuupa Ork <kuupaork+github@hfdl.observer>
+# see LICENSE (or https://github.com/hfdl-observer/hfdlobserver888/blob/main/LICENSE) for terms of use.
+# TL;DR: BSD 3-clause
+#
+
+import collections
+import functools
+import inspect
+import logging
+import math
+import time
+
+from typing import Any, Callable, Optional
+
+import hfdl_observer.bus
+import hfdl_observer.hfdl
+
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50, 95, 99)
+PacketCallback = Callable[[hfdl_observer.hfdl.HFDLPacketInfo], Any]
+
+
+class Histogram:
+    # A streaming histogram with logarithmic buckets: each bucket is `growth` times as wide as the one below it, so
+    # percentiles are within a few percent of exact in a fixed, small amount of memory, however many values are
+    # added. Values at or below `low` share the first bucket.
+    count: int
+    total: float
+    max: float
+    buckets: dict[int, int]
+
+    def __init__(self, low: float = 1e-4, growth: float = 1.05) -> None:
+        self.low = low
+        self.growth = growth
+        self.log_growth = math.log(growth)
+        self.reset()
+
+    def reset(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = {}
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        index = int(math.log(value / self.low) / self.log_growth) + 1 if value > self.low else 0
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other: 'Histogram') -> None:
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def bucket_value(self, index: int) -> float:
+        # the geometric middle of the bucket.
+        return self.low * self.growth ** (index - 0.5) if index else self.low
+
+    def percentile(self, percent: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = percent / 100 * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.bucket_value(index), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self) -> dict[str, float]:
+        result = {'count': self.count, 'mean': self.mean, 'max': self.max}
+        for percent in PERCENTILES:
+            result[f'p{percent}'] = self.percentile(percent)
+        return result
+
+    def __str__(self) -> str:
+        summary = self.summary()
+        percentiles = ' '.join(f'p{p}={duration(summary[f"p{p}"])}' for p in PERCENTILES)
+        return f'n={self.count} {percentiles} max={duration(self.max)}'
+
+
+def duration(seconds: float) -> str:
+    if seconds < 0.001:
+        return f'{seconds * 1e6:.0f}µs'
+    return f'{seconds * 1000:.1f}ms'
+
+
+def merged(histograms: list[Histogram]) -> Histogram:
+    result = Histogram(histograms[0].low, histograms[0].growth) if histograms else Histogram()
+    for histogram in histograms:
+        result.merge(histogram)
+    return result
+
+
+def callback_name(callback: Callable) -> str:
+    return getattr(callback, '__qualname__', None) or repr(callback)
+
+
+def frame_time(packet: hfdl_observer.hfdl.HFDLPacketInfo) -> float:
+    t = packet.packet['t']
+    return t['sec'] + t.get('usec', 0) / 1e6  # type: ignore
+
+
+class LatencyTracker(hfdl_observer.bus.PeriodicTask, hfdl_observer.bus.Publisher):
+    # Times packets from when dumphfdl stamped the frame until each consumer callback has finished with it, per
+    # stage (callback) and per receiver. When not collecting, `wrap` hands back the callback untouched, so the
+    # packet path costs nothing extra. Summaries are published (and logged) every `period` seconds.
+    # Packets delivered over the bus are timed per subscriber by installing the tracker as the bus monitor; any
+    # monitor already installed still sees every publish and delivery, through the tracker.
+    histograms: dict[tuple[str, str], Histogram]
+    recorded: int = 0
+    reported: int = 0
+    monitor: Optional[hfdl_observer.bus.BusMonitor] = None
+
+    def __init__(self, config: dict, receiver_for: Optional[Callable[[int], Optional[str]]] = None) -> None:
+        hfdl_observer.bus.PeriodicTask.__init__(self, config.get('period', 300))
+        hfdl_observer.bus.Publisher.__init__(self)
+        self.collecting = bool(config.get('latency', False))
+        self.receiver_for = receiver_for
+        self.histograms = {}
+
+    def wrap(self, callback: PacketCallback, stage: Optional[str] = None) -> PacketCallback:
+        if not self.collecting:
+            return callback
+        stage = stage or callback_name(callback)
+        record = self.record
+
+        if inspect.iscoroutinefunction(callback):
+            @functools.wraps(callback)
+            async def timed_async(packet: hfdl_observer.hfdl.HFDLPacketInfo) -> Any:
+                result = await callback(packet)
+                record(stage, packet)  # type: ignore
+                return result
+            return timed_async
+
+        @functools.wraps(callback)
+        def timed(packet: hfdl_observer.hfdl.HFDLPacketInfo) -> Any:
+            result = callback(packet)
+            record(stage, packet)  # type: ignore
+            return result
+        return timed
+
+    def install(self) -> None:
+        if self.collecting:
+            self.monitor = hfdl_observer.bus.monitor
+            hfdl_observer.bus.monitor = self
+
+    def published(self, publisher: hfdl_observer.bus.Publisher, subject: str, subscribers: int) -> None:
+        if self.monitor is not None:
+            self.monitor.published(publisher, subject, subscribers)
+
+    def coalesced(self, publisher: hfdl_observer.bus.Publisher, subject: str, saved: int) -> None:
+        if self.monitor is not None:
+            self.monitor.coalesced(publisher, subject, saved)
+
+    def deliver(
+        self,
+        publisher: hfdl_observer.bus.Publisher,
+        subject: str,
+        subscriber: Callable,
+        body: Any,
+        published_at: Optional[float],
+    ) -> None:
+        if self.monitor is not None:
+            self.monitor.deliver(publisher, subject, subscriber, body, published_at)
+        else:
+            subscriber(body)
+        if isinstance(body, hfdl_observer.hfdl.HFDLPacketInfo):
+            self.record(callback_name(subscriber), body)
+
+    def record(self, stage: str, packet: hfdl_observer.hfdl.HFDLPacketInfo) -> None:
+        latency = max(0.0, time.time() - frame_time(packet))
+        receiver = (self.receiver_for(packet.frequency) if self.receiver_for else None) or 'unassigned'
+        key = (stage, receiver)
+        try:
+            histogram = self.histograms[key]
+        except KeyError:
+            histogram = self.histograms[key] = Histogram()
+        histogram.add(latency)
+        self.recorded += 1
+
+    def by_stage(self) -> dict[str, Histogram]:
+        stages: dict[str, list[Histogram]] = {}
+        for (stage, _), histogram in self.histograms.items():
+            stages.setdefault(stage, []).append(histogram)
+        return {stage: merged(histograms) for stage, histograms in sorted(stages.items())}
+
+    def by_receiver(self) -> dict[str, Histogram]:
+        receivers: dict[str, list[Histogram]] = {}
+        for (_, receiver), histogram in self.histograms.items():
+            receivers.setdefault(receiver, []).append(histogram)
+        return {receiver: merged(histograms) for receiver, histograms in sorted(receivers.items())}
+
+    def summary(self) -> dict[str, dict[str, dict[str, float]]]:
+        return {
+            'stages': {stage: histogram.summary() for stage, histogram in self.by_stage().items()},
+            'receivers': {receiver: histogram.summary() for receiver, histogram in self.by_receiver().items()},
+        }
+
+    async def execute(self) -> None:
+        if self.recorded == self.reported:  # nothing new.
+            return
+        self.reported = self.recorded
+        self.dump()
+        self.publish('latency', self.summary())
+
+    def dump(self) -> None:
+        for stage, histogram in self.by_stage().items():
+            logger.info(f'latency to {stage}: {histogram}')
+        for receiver, histogram in self.by_receiver().items():
+            logger.info(f'latency from {receiver}: {histogram}')
+
+    def __str__(self) -> str:
+        return f'<LatencyTracker @ {self.period}>'
+
+
+class BusMetrics(hfdl_observer.bus.PeriodicTask):
+    # Installed as the bus monitor, it counts the messages published on every topic (publisher class and subject),
+    # times each subscriber's callback, and measures how long deliveries wait on the loop after being published
+    # (a measure of the loop's backlog). A summary, busiest topics first, is logged every `period` seconds and on
+    # demand.
+    messages: collections.Counter[tuple[str, str]]
+    saved: collections.Counter[tuple[str, str]]
+    delays: dict[tuple[str, str], Histogram]
+    timings: dict[tuple[str, str, str], Histogram]
+    reported: int = 0
+
+    def __init__(self, config: dict) -> None:
+        super().__init__(config.get('period', 300))
+        self.messages = collections.Counter()
+        self.saved = collections.Counter()
+        self.delays = {}
+        self.timings = {}
+
+    def install(self) -> None:
+        hfdl_observer.bus.monitor = self
+
+    def published(self, publisher: hfdl_observer.bus.Publisher, subject: str, subscribers: int) -> None:
+        self.messages[(type(publisher).__name__, subject)] += 1
+
+    def coalesced(self, publisher: hfdl_observer.bus.Publisher, subject: str, saved: int) -> None:
+        self.saved[(type(publisher).__name__, subject)] += saved
+
+    def deliver(
+        self,
+        publisher: hfdl_observer.bus.Publisher,
+        subject: str,
+        subscriber: Callable,
+        body: Any,
+        published_at: Optional[float],
+    ) -> None:
+        start = time.perf_counter()
+        try:
+            subscriber(body)
+        finally:
+            elapsed = time.perf_counter() - start
+            topic = (type(publisher).__name__, subject)
+            key = (*topic, callback_name(subscriber))
+            try:
+                timing = self.timings[key]
+            except KeyError:
+                timing = self.timings[key] = Histogram(low=1e-6)
+            timing.add(elapsed)
+            if published_at is not None:
+                try:
+                    delay = self.delays[topic]
+                except KeyError:
+                    delay = self.delays[topic] = Histogram(low=1e-6)
+                delay.add(start - published_at)
+
+    def dump(self) -> None:
+        total = sum(self.messages.values())
+        logger.info(
+            f'bus: {len(self.messages)} topics, {total} messages, {sum(self.saved.values())} deliveries coalesced'
+        )
+        by_topic: dict[tuple[str, str], list[tuple[str, Histogram]]] = {}
+        for (publisher, subject, subscriber), timing in self.timings.items():
+            by_topic.setdefault((publisher, subject), []).append((subscriber, timing))
+        for topic in sorted(self.messages, key=lambda t: -sum(h.total for _, h in by_topic.get(t, []))):
+            delay = self.delays.get(topic)
+            logger.info(
+                f'bus {topic[0]}:{topic[1]} messages={self.messages[topic]} saved={self.saved[topic]}'
+                f'{f" delay {delay}" if delay else ""}'
+            )
+            for subscriber, timing in sorted(by_topic.get(topic, []), key=lambda e: -e[1].total):
+                logger.info(f'bus   -> {subscriber} total={duration(timing.total)} {timing}')
+
+    async def execute(self) -> None:
+        total = sum(self.messages.values())
+        if total != self.reported:
+            self.reported = total
+            self.dump()
+
+    def __str__(self) -> str:
+        return f'<BusMetrics @ {self.period}>'
@@ -0,0 +1,115 @@
+# hfdl_observer/replay.py
+# copyright 2024 Kuupa Ork <kuupaork+github@hfdl.observer>
+# see LICENSE (or https://github.com/hfdl-observer/hfdlobserver888/blob/main/LICENSE) for terms of use.
+# TL;DR: BSD 3-clause
+#
+
+import asyncio
+import gzip
+import json
+import logging
+import pathlib
+import re
+import time
+
+from typing import Iterator, Optional, Union
+
+import hfdl_observer.bus
+import hfdl_observer.listeners
+
+
+logger = logging.getLogger(__name__)
+
+# dumphfdl writes compact JSON, so the frame timestamp can be found (and rewritten) without decoding the packet.
+TIMESTAMP_RE = re.compile(r'"t":\s*\{\s*"sec":\s*(\d+),\s*"usec":\s*(\d+)\s*\}')
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def packet_log_lines(paths: list[Union[str, pathlib.Path]]) -> Iterator[str]:
+    # packet logs as written by the decoder `packetlog` option; rotated logs may have been compressed.
+    for path in paths:
+        with open(path, 'rb') as f:
+            compressed = f.read(2) == GZIP_MAGIC
+        opener = gzip.open if compressed else open
+        with opener(path, 'rt', encoding='utf8', errors='replace') as f:  # type: ignore
+            for line in f:
+                line = line.strip()
+                if line.startswith('{'):
+                    yield line
+
+
+def packet_time(line: str) -> Optional[float]:
+    match = TIMESTAMP_RE.search(line)
+    if match:
+        return int(match.group(1)) + int(match.group(2)) / 1e6
+    try:
+        t = json.loads(line).get('hfdl', {})['t']
+        return t['sec'] + t.get('usec', 0) / 1e6  # type: ignore
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+class PacketLogReplayer(hfdl_observer.bus.Publisher):
+    # Feeds packet logs into a listener's ingest queue, as if the packets were arriving from decoders. `speed` is a
+    # multiple of real time; 0 replays as fast as the pipeline will take them. With `retime`, each packet's frame
+    # time is replaced with the time it is replayed, so everything that ages data by the wall clock (packet bins,
+    # frequency expiry, the reaper) sees it as live traffic.
+    packets: int = 0
+    skipped: int = 0
+    elapsed: float = 0.0
+    task: Optional[asyncio.Task] = None
+
+    def __init__(
+        self, paths: list[Union[str, pathlib.Path]], speed: float = 1.0, retime: bool = True, batch_size: int = 256
+    ) -> None:
+        super().__init__()
+        self.paths = paths
+        self.speed = speed
+        self.retime = retime
+        self.batch_size = batch_size
+
+    def retimed(self, line: str, when: float) -> str:
+        return TIMESTAMP_RE.sub(
+            f'"t":{{"sec":{int(when)},"usec":{int((when % 1) * 1e6)}}}', line, count=1
+        )
+
+    async def run(self, queue: hfdl_observer.listeners.IngestQueue) -> None:
+        logger.info(f'replaying {len(self.paths)} packet log(s) at {self.speed or "maximum"} speed')
+        start = time.time()
+        first: Optional[float] = None
+        for line in packet_log_lines(self.paths):
+            when = packet_time(line)
+            if when is None:
+                self.skipped += 1
+                continue
+            if first is None:
+                first = when
+            if self.speed:
+                delay = start + (when - first) / self.speed - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            else:
+                # as fast as possible, but do not outrun the queue (which would drop packets).
+                while len(queue) >= queue.maxsize // 2:
+                    await asyncio.sleep(0)
+                if self.packets % self.batch_size == 0:
+                    await asyncio.sleep(0)
+            queue.put(self.retimed(line, time.time()) if self.retime else line, 'replay')
+            self.packets += 1
+        while len(queue):
+            await asyncio.sleep(0.01)
+        self.elapsed = time.time() - start
+        logger.info(
+            f'replayed {self.packets} packets in {self.elapsed:.1f}s'
+            f' ({self.packets / (self.elapsed or 1):.0f} packets/s, {self.skipped} skipped)'
+        )
+        self.publish('done', self)
+
+    def start(self, queue: hfdl_observer.listeners.IngestQueue) -> asyncio.Task:
+        self.task = asyncio.get_running_loop().create_task(self.run(queue))
+        return self.task
+
+    def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            self.task = None
@@ -0,0 +1,80 @@
+# hfdl_observer/watch.py
+# copyright 2024 Kuupa Ork <kuupaork+github@hfdl.observer>
+# see LICENSE (or https://github.com/hfdl-observer/hfdlobserver888/blob/main/LICENSE) for terms of use.
+# TL;DR: BSD 3-clause
+#
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import pathlib
+import struct
+
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len (then `len` bytes of name)
+
+_libc: Optional[ctypes.CDLL] = None
+
+
+def libc() -> Optional[ctypes.CDLL]:
+    global _libc
+    if _libc is None:
+        try:
+            _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            _libc.inotify_init1
+        except (OSError, AttributeError):
+            return None
+    return _libc
+
+
+class Inotify:
+    # A minimal inotify binding, watching one directory. Watching the directory (rather than the file) sees files
+    # replaced by rename, as atomic writers and many editors do.
+    fd: int = -1
+
+    def __init__(self, directory: pathlib.Path) -> None:
+        lib = libc()
+        if lib is None:
+            raise OSError('inotify is not available')
+        self.fd = lib.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        if lib.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            self.close()
+            raise OSError(errno, f'inotify_add_watch failed for {directory}')
+
+    def read_names(self) -> set[str]:
+        # the names of the files with events pending.
+        names = set()
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset + IN_EVENT.size <= len(data):
+                _, _, _, length = IN_EVENT.unpack_from(data, offset)
+                offset += IN_EVENT.size
+                names.add(data[offset:offset + length].rstrip(b'\0').decode(errors='replace'))
+                offset += length
+        return names
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
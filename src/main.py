@@ -15,7 +15,7 @@ import logging.handlers
 import pathlib
 import sys
 
-from signal import SIGINT, SIGTERM
+from signal import SIGINT, SIGTERM, SIGUSR1
 from typing import Callable, Optional
 
 import click
@@ -25,6 +25,8 @@ import hfdl_observer.data
 import hfdl_observer.hfdl
 import hfdl_observer.listeners
 import hfdl_observer.manage
+import hfdl_observer.metrics
+import hfdl_observer.replay
 
 import receivers
 import settings
@@ -39,27 +41,41 @@ class Observer888(hfdl_observer.bus.Publisher):
     proxies: list[hfdl_observer.manage.ReceiverProxy]
     parameters: hfdl_observer.data.Parameters
     running: bool = True
+    packet_source: Optional[hfdl_observer.replay.PacketLogReplayer] = None
 
-    def __init__(self, config: collections.abc.Mapping) -> None:
+    def __init__(
+        self, config: collections.abc.Mapping, packet_source: Optional[hfdl_observer.replay.PacketLogReplayer] = None
+    ) -> None:
         super().__init__()
         self.config = config
+        self.packet_source = packet_source
+        self.proxies = []
+        metrics_config = config.get('metrics', {})
+        self.latency = hfdl_observer.metrics.LatencyTracker(metrics_config, self.receiver_name)
+        self.bus_metrics = hfdl_observer.metrics.BusMetrics(metrics_config) if metrics_config.get('bus') else None
+        if self.bus_metrics:
+            self.bus_metrics.install()
+        self.latency.install()  # after the bus metrics, which it passes deliveries on to.
         self.active_ground_stations = hfdl_observer.manage.ActiveGroundStations(config['tracker'])
-        self.active_ground_stations.subscribe('frequencies', self.on_frequencies)
+        self.active_ground_stations.subscribe('delta', self.on_delta)
         self.hfdl_listener = hfdl_observer.listeners.HFDLListener(config.get('hfdl_listener', {}))
+        self.hfdl_listener.subscribe('ingest', self.on_ingest_stats)
+        self.ingest_dropped = 0
+        self.ingest_duplicates = 0
         self.hfdl_consumers = [
-            hfdl_observer.listeners.HFDLPacketConsumer(
-                [hfdl_observer.listeners.HFDLPacketConsumer.any_in('spdu', 'freq_data')],
-                [self.active_ground_stations.on_hfdl],
+            hfdl_observer.listeners.HFDLPacketConsumer.for_types(
+                hfdl_observer.hfdl.PacketType.SQUITTER | hfdl_observer.hfdl.PacketType.PERFORMANCE,
+                [self.latency.wrap(self.active_ground_stations.on_hfdl)],
             ),
-            hfdl_observer.listeners.HFDLPacketConsumer(
-                [lambda line: True],
-                [self.on_hfdl],
+            hfdl_observer.listeners.HFDLPacketConsumer.for_types(
+                hfdl_observer.hfdl.PacketType.ANY,
+                [self.latency.wrap(self.on_hfdl)],
             ),
         ]
         self.conductor = hfdl_observer.manage.SimpleConductor(config['conductor'])
         self.parameters = self.conductor.parameters
+        self.reap_hfdl = self.latency.wrap(self.conductor.reaper.on_hfdl)
 
-        self.proxies = []
         self.local_receivers = []
 
         for rname in config['local_receivers']:
@@ -78,6 +94,20 @@ class Observer888(hfdl_observer.bus.Publisher):
         self.proxies.append(proxy)
         self.conductor.add_receiver(proxy)
 
+    def receiver_name(self, frequency: int) -> Optional[str]:
+        for proxy in self.proxies:
+            if proxy.allocation and frequency in proxy.allocation:
+                return proxy.name
+        return None
+
+    def on_delta(self, delta: hfdl_observer.data.FrequencyDelta) -> None:
+        if self.conductor.affects(delta, self.active_ground_stations.inactive_station_frequencies):
+            self.on_frequencies(delta.frequencies)
+            return
+        logger.debug(f'allocations unaffected by {delta}')
+        self.publish('active', list(itertools.chain(*delta.frequencies.values())))
+        self.publish('frequencies', delta.frequencies)
+
     def on_frequencies(self, stations: dict[int, list[int]]) -> None:
         allocations = self.conductor.allocate_frequencies(stations)
         # field allocations come from the "inactive" system table frequencies
@@ -93,7 +123,19 @@ class Observer888(hfdl_observer.bus.Publisher):
 
     def on_hfdl(self, packet: hfdl_observer.hfdl.HFDLPacketInfo) -> None:
         self.publish('packet', packet)
-        self.conductor.reaper.on_hfdl(packet)
+        self.reap_hfdl(packet)
+
+    def on_ingest_stats(self, stats: dict[str, int]) -> None:
+        if stats['dropped'] > self.ingest_dropped:
+            logger.warning(f'ingest queue dropped {stats["dropped"] - self.ingest_dropped} packets ({stats})')
+        else:
+            logger.debug(f'ingest queue {stats}')
+        self.ingest_dropped = stats['dropped']
+        duplicates = self.hfdl_listener.duplicates
+        if duplicates and stats.get('duplicates', 0) > self.ingest_duplicates:
+            logger.info(f'suppressed {stats["duplicates"]} duplicate packets; by source pair {duplicates.stats()}')
+            self.ingest_duplicates = stats['duplicates']
+        self.publish('ingest', stats)
 
     def on_fatal_error(self, data: tuple[str, str]) -> None:
         receiver, error = data
@@ -102,13 +144,30 @@ class Observer888(hfdl_observer.bus.Publisher):
 
     def start(self) -> None:
         self.active_ground_stations.start()
-        self.hfdl_listener.start(self.hfdl_consumers)  # self.active_ground_stations.on_hfdl)
+        if self.packet_source:
+            self.hfdl_listener.start(self.hfdl_consumers, listen=False)
+            self.packet_source.start(self.hfdl_listener.queue)
+        else:
+            self.hfdl_listener.start(self.hfdl_consumers)  # self.active_ground_stations.on_hfdl)
         self.conductor.reaper.start()
+        if self.latency.collecting:
+            asyncio.get_running_loop().create_task(self.latency.run())
+        if self.bus_metrics:
+            asyncio.get_running_loop().create_task(self.bus_metrics.run())
+
+    def dump_metrics(self) -> None:
+        if self.latency.collecting:
+            self.latency.dump()
+        if self.bus_metrics:
+            self.bus_metrics.dump()
+        if not (self.latency.collecting or self.bus_metrics):
+            logger.info('no metrics are being collected (see `metrics` in the settings)')
 
     def kill(self) -> None:
         logger.warning(f'{self} killed')
         for receiver in self.local_receivers:
             receiver.kill()
+        self.close()
 
 
 async def async_observe(observer: Observer888) -> None:
@@ -134,11 +193,12 @@ def cancel_all_tasks() -> None:
 def observe(
     on_observer: Optional[Callable[[
         Observer888, packet_stats.BinnedPacketCounter, packet_stats.CumulativePacketStats
-    ], None]] = None
+    ], None]] = None,
+    packet_source: Optional[hfdl_observer.replay.PacketLogReplayer] = None,
 ) -> None:
     loop = asyncio.get_event_loop()
 
-    observer = Observer888(settings.registry['observer888'])
+    observer = Observer888(settings.registry['observer888'], packet_source)
 
     packet_counter = packet_stats.BinnedPacketCounter()
     observer.subscribe('packet', packet_counter.on_hfdl)
@@ -157,6 +217,7 @@ def observe(
     main_task = asyncio.ensure_future(async_observe(observer))
     for signal in [SIGINT, SIGTERM]:
         loop.add_signal_handler(signal, cancel_all_tasks)
+    loop.add_signal_handler(SIGUSR1, observer.dump_metrics)
     try:
         loop.run_until_complete(main_task)
     finally:
@@ -21,6 +21,7 @@ logger = logging.getLogger()
 
 
 Sample = collections.namedtuple('Sample', ['when', 'freq', 'snr'])
+UPDATE_WINDOW = 0.25
 
 STATION_ABBREVIATIONS = {
     1: 'SANFRAN',
@@ -50,6 +51,11 @@ class CumulativePacketStats(hfdl_observer.bus.Publisher):
     no_position: int = 0
     squitters: int = 0
 
+    def __init__(self) -> None:
+        super().__init__()
+        # totals change with every packet; subscribers only need to see them a few times a second.
+        self.coalesce('update', UPDATE_WINDOW)
+
     def on_hfdl(self, packet: hfdl_observer.hfdl.HFDLPacketInfo) -> None:
         self.packets += 1
         if packet.is_downlink:
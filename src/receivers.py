@@ -128,7 +128,8 @@ class DummyReceiver(Web888Receiver):
         self.decoder = decoders.DummyDecoder(self.name, self.config.get('decoder', {}), self.listener)
 
     async def run(self) -> None:
-        pass
+        # nothing to run, but report the allocation as a real receiver would.
+        self.publish(f'receiver:{self.name}', ('listening', self.allocation.frequencies))
 
 
 class Web888ExecReceiver(Web888Receiver):
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# replay.py
+# copyright 2024 Kuupa Ork <kuupaork+github@hfdl.observer>
+# see LICENSE (or https://github.com/hfdl-observer/hfdlobserver888/blob/main/LICENSE) for terms of use.
+# TL;DR: BSD 3-clause
+#
+
+import logging.handlers
+import pathlib
+import sys
+
+from typing import Any, Optional
+
+import click
+
+import hfdl_observer.replay
+
+import main
+import settings
+
+
+def prepare_settings() -> None:
+    observer_settings = settings.registry['observer888']
+    # no Web-888 is needed: receivers only pretend to listen, so the conductor still assigns frequencies.
+    for rname in observer_settings['local_receivers']:
+        observer_settings['all_receivers'][rname] = {'config': 'dummy'}
+    # keep replays reproducible, and away from the live station state.
+    observer_settings['tracker']['station_updates'] = []
+    observer_settings['tracker']['state'] = None
+
+
+@click.command
+@click.option('--headless', help='Run headless; with no CUI.', is_flag=True)
+@click.option('--debug', help='Output debug/extra information.', is_flag=True)
+@click.option(
+    '--log',
+    help='log output to this file',
+    type=click.Path(
+        path_type=pathlib.Path,
+        writable=True,
+        file_okay=True,
+        dir_okay=False,
+    ),
+    default=None)
+@click.option(
+    '--config',
+    help='load settings from this file',
+    type=click.Path(
+        path_type=pathlib.Path,
+        readable=True,
+        file_okay=True,
+        dir_okay=False,
+        exists=True,
+    ), default=None,
+)
+@click.option('--speed', help='Replay at this multiple of real time.', default=1.0)
+@click.option('--fast', help='Replay as fast as possible.', is_flag=True)
+@click.option('--keep-times', help='Keep the original packet times instead of replay times.', is_flag=True)
+@click.option('--linger', help='Keep running after the replay finishes.', is_flag=True)
+@click.argument(
+    'packetlogs', nargs=-1, required=True,
+    type=click.Path(path_type=pathlib.Path, readable=True, file_okay=True, dir_okay=False, exists=True),
+)
+def command(
+    headless: bool, debug: bool, log: Optional[pathlib.Path], config: Optional[pathlib.Path],
+    speed: float, fast: bool, keep_times: bool, linger: bool, packetlogs: list[pathlib.Path],
+) -> None:
+    settings.load(config or (pathlib.Path(__file__).parent.parent / 'settings.yaml'))
+    prepare_settings()
+    handler = logging.handlers.TimedRotatingFileHandler(log, when='d', interval=1) if log else None
+
+    replayer = hfdl_observer.replay.PacketLogReplayer(list(packetlogs), 0 if fast else speed, not keep_times)
+    if not linger:
+        def on_done(_: Any) -> None:
+            main.cancel_all_tasks()
+        replayer.subscribe('done', on_done)
+
+    headless = headless or not sys.stdout.isatty()
+    if headless:
+        main.setup_logging(handler, debug)
+        main.observe(packet_source=replayer)
+    else:
+        import cui
+        cui.screen(handler, debug, packet_source=replayer)
+
+
+if __name__ == '__main__':
+    command()
@@ -24,6 +24,10 @@ registry: dict[str, dict] = {
     'observer888': {
         'conductor': {
             'slot_width': 12,
+            # `allocator` chooses how active frequencies are shared among the receivers. `greedy` fills them first-fit
+            # in station rank order; `coverage` chooses the allocations covering the most frequencies (weighted by
+            # station rank) for the receivers available, at more cost per allocation.
+            'allocator': 'greedy',
             # ignored_frequencies is a list of frequencies to ignore in assigning receivers.
             # Each entry in the list can be a single frequency (kHz) or a pair of frequencies specifying a closed
             # interval (inclusive)
@@ -32,18 +36,23 @@ registry: dict[str, dict] = {
         },
         'tracker': {
             # `station_files` files to load station configurations from. should not normally need to be changed.
+            # The decoders' `system_table_save` file (systable_updated.conf) may be listed too.
             'station_files': ['systable.conf'],
             # `station_updates` tracks the remote sources for active frequencies
             # 'station_updates': [
             #     {
             #         'url': "https://hfdl.observer/active.json",  # the URL of the station data.
             #         'period': 61,  # how often (seconds) to query.
+            #         'timeout': [10, 30],  # connect and read timeouts (seconds).
             #     },
             # ],
             # `station_url` location of a JSON file with up to date active frequency lists. The default should be fine.
             'station_url': [],
             # `state` local file to keep up dated active station data. should not normally need to be changed.
             'state': 'stations.state',
+            # `compact_after` changes to `state` are journaled beside it (`stations.state.journal`), and folded back
+            # into it after this many saves.
+            'compact_after': 200,
             # `save_delay` a period after a change is detected before `state` is written, to allow multiple changes
             # to be bundled
             # and save a bit of wear and tear on sdcards if that's important. May be adjusted (seconds) but will also
@@ -51,10 +60,48 @@ registry: dict[str, dict] = {
             'save_delay': 8,
         },
         'hfdl_listener': {
-            # only udp is supported. 0.0.0.0 address is not properly tolerated. Will need to be addressed when
+            # `proto` is how decoders deliver packets: 'udp' (the default), 'tcp' (a lossless stream per decoder),
+            # or 'unix' (a Unix domain stream socket at `path`; dumphfdl cannot write to one directly, so it needs
+            # a bridge such as socat). 0.0.0.0 address is not properly tolerated. Will need to be addressed when
             # remotes are allowed.
+            'proto': 'udp',
             'address': '127.0.0.1',
             'port': 5540,
+            # `json_decoder` selects the backend used to decode packets: 'stdlib', 'orjson', 'msgspec' or
+            # 'msgspec-typed' (validates the dumphfdl envelope against a schema). 'auto' picks the fastest one
+            # installed, falling back to the standard library.
+            'json_decoder': 'auto',
+            # `decode_workers` moves packet decoding into this many worker processes, leaving the event loop free
+            # for supervising receivers and the display. 0 decodes on the event loop. Packets are handed to the
+            # workers in batches of up to `decode_batch_size` lines, or after `decode_batch_interval` seconds. At most
+            # `decode_max_batches` batches (by default, twice the workers) are in the workers' hands; beyond that,
+            # lines are left in the queue below.
+            'decode_workers': 0,
+            'decode_batch_size': 64,
+            'decode_batch_interval': 0.05,
+            # 'decode_max_batches': 2,
+            # received lines wait in a queue of up to `queue_size` lines for decoding. When it is full,
+            # `queue_overflow` decides which are lost: 'drop-oldest' or 'drop-newest'. Queue counters (enqueued,
+            # dropped, max depth) are published (and logged, if there are losses) every `queue_stats_period` seconds.
+            'queue_size': 4096,
+            'queue_overflow': 'drop-oldest',
+            'queue_stats_period': 60,
+            # the same frame can arrive from two decoders (overlapping passbands, or during a retune). Frames seen
+            # within `dedup_horizon` seconds, up to `dedup_size` of them, are remembered and repeats dropped before
+            # they are counted. 0 disables this.
+            'dedup_horizon': 10,
+            'dedup_size': 4096,
+        },
+        'metrics': {
+            # `latency` times every packet from when dumphfdl stamped the frame until each consumer (the tracker,
+            # the reaper, packet stats, the display) has handled it, and keeps p50/p95/p99 per consumer and per
+            # receiver. Off by default; it costs nothing when off.
+            'latency': False,
+            # `bus` counts messages per topic on the internal message bus, times every subscriber, and measures how
+            # long deliveries wait on the event loop. Useful for finding what is eating a slow machine.
+            'bus': False,
+            # summaries are logged every `period` seconds, and whenever the observer receives SIGUSR1.
+            'period': 300,
         },
         'local_receivers': [f'observer-{x:02}' for x in range(1, 14)],
         'all_receivers': {f'observer-{x:02}': {'config': 'web888'} for x in range(1, 14)}